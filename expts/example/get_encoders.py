@@ -414,5 +414,20 @@ for embedder_name, embedder in embedders.items():
             encoder_dict[task] = {**embedder, **extractor}
         encoders[encoder_name] = encoder_dict
 
+# the sparse bag of words embedder outputs one vector per text, so it only
+# goes with the no_op extractor(use with --input_key sparse_bow)
+encoders['no_op_sparse_bow'] = {
+    'embedders_tied': False,
+    'extractors_tied': True,
+}
+for task in MATERIAL_TASKS:
+    encoders['no_op_sparse_bow'][task] = {
+        'embed_fn': 'sparse_bow_embedding',
+        'embed_kwargs': {
+            'embed_dim': EMBED_DIM
+        },
+        **extractors['no_op']
+    }
+
 with codecs.open('encoders.json', mode='w', encoding='utf-8') as file:
     json.dump(encoders, file, ensure_ascii=False, indent=4)
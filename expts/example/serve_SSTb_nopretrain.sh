@@ -0,0 +1,20 @@
+python ../scripts/prediction_server.py \
+       --host 127.0.0.1 \
+       --port 8000 \
+       --max_batch_size 32 \
+       --max_wait_ms 5 \
+       --model mult \
+       --datasets SSTb \
+       --class_sizes 5 \
+       --dataset_paths data/tf/single/SSTb/min_1_max_-1_vocab_-1_doc_-1_tok_tweet/ \
+       --encoder_config_file encoders.json \
+       --architecture meanmax_relu_0.1_nopretrain \
+       --shared_mlp_layers 0 \
+       --shared_hidden_dims 0 \
+       --private_mlp_layers 1 \
+       --private_hidden_dims 64 \
+       --alphas 1 \
+       --optimizer rmsprop \
+       --lr0 0.001 \
+       --seed 42 \
+       --checkpoint_dir ./data/ckpt/SSTb_nopretrain/
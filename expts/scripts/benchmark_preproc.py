@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Measures the throughput(docs/sec) of the text preprocessing(preproc=True)
+before and after fast_preproc() on the text of a json dataset
+
+Usage: python benchmark_preproc.py data_json_path [text_field_name]
+e.g. python benchmark_preproc.py data/json/SSTb/data.json.gz text
+"""
+
+import sys
+from time import time
+
+from docutils.io import InputError
+
+from mtl.util.constants import OLD_LINEBREAKS, LINEBREAK
+from mtl.util.data_prep import fast_preproc, preproc
+from mtl.util.dataset import read_json_examples
+
+
+def reference_preproc(text):
+    text = text.strip()
+    text = preproc(text)
+    for old_linebreak in OLD_LINEBREAKS:
+        text = text.replace(old_linebreak, LINEBREAK)
+    return text
+
+
+def benchmark(preproc_fn, docs):
+    start_time = time()
+    outputs = [preproc_fn(doc) for doc in docs]
+    elapsed = time() - start_time
+    return outputs, len(docs) / elapsed if elapsed > 0 else float('inf')
+
+
+def main():
+    if len(sys.argv) not in [2, 3]:
+        raise InputError(
+            "Usage: python benchmark_preproc.py data_json_path "
+            "[text_field_name]")
+
+    text_field_name = sys.argv[2] if len(sys.argv) == 3 else 'text'
+    docs = [item[text_field_name]
+            for item in read_json_examples(sys.argv[1])]
+    print('%d documents' % len(docs))
+
+    reference_outputs, reference_speed = benchmark(reference_preproc, docs)
+    print('preproc: %.1f docs/sec' % reference_speed)
+    fast_outputs, fast_speed = benchmark(fast_preproc, docs)
+    print('fast_preproc: %.1f docs/sec(%.1fx)' % (
+        fast_speed, fast_speed / reference_speed))
+
+    mismatches = sum(reference_output != fast_output
+                     for reference_output, fast_output in
+                     zip(reference_outputs, fast_outputs))
+    print('%d documents preprocessed differently' % mismatches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Converts a pre-trained word embedding file to a float32 .npy matrix and a
+vocabulary file, which are loaded memory-mapped instead of parsed as text
+
+Usage: python convert_embeddings.py pretrained_path [npy_path]
+e.g. python convert_embeddings.py glove/glove.6B.50d.txt writes
+glove/glove.6B.50d.npy and glove/glove.6B.50d.vocab
+"""
+
+import sys
+
+from docutils.io import InputError
+
+from mtl.util.load_embeds import convert_pretrained
+
+
+def main():
+    if len(sys.argv) not in [2, 3]:
+        raise InputError(
+            "Usage: python convert_embeddings.py pretrained_path [npy_path]")
+
+    pretrained_path = sys.argv[1]
+    store_path = sys.argv[2] if len(sys.argv) == 3 else None
+
+    store_path = convert_pretrained(pretrained_path, store_path)
+    print('Saved to %s' % store_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -33,9 +33,11 @@ from six.moves import xrange
 from tensorflow.contrib.training import HParams
 from tqdm import tqdm
 
+from mtl.embedders.pretrained import init_pretrained_embeddings
 from mtl.models.mult import Mult
 from mtl.util.constants import ALL_METRICS
-from mtl.util.metrics import accurate_number, metric2func
+from mtl.util.metrics import StreamingMetrics
+from mtl.util.optimizer import OPTIMIZERS, Optimizer
 from mtl.util.pipeline import Pipeline
 from mtl.util.util import make_dir
 
@@ -44,7 +46,7 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 logging = tf.logging
 
 
-def parse_args():
+def parse_args(argv=None):
     p = ap.ArgumentParser()
     p.add_argument('--model', type=str,
                    help='Which model to use [mlvae|mult]')
@@ -87,12 +89,19 @@ def parse_args():
                    help='Word embedding size')
     p.add_argument('--share_decoders', action='store_true', default=False,
                    help='Whether decoders are shared across datasets')
-    p.add_argument('--optimizer', default='adam', type=str,
-                   help='Name of optimization algorithm to use')
+    p.add_argument('--optimizer', default='adam', choices=OPTIMIZERS,
+                   help='Name of optimization algorithm to use. lazy_adam '
+                        'and adafactor only update the embedding rows in the '
+                        'batch; adafactor ignores --lr0')
+    p.add_argument('--optimizer_slot_dtype', default='float32',
+                   choices=['float32', 'bfloat16', 'float16'],
+                   help='Store the optimizer slots in this dtype to save '
+                        'memory, only supported by adafactor')
     p.add_argument('--lr0', default=0.001, type=float,
                    help='Initial learning rate')
-    p.add_argument('--max_grad_norm', default=5.0, type=float,
-                   help='Clip gradients to max_grad_norm during training.')
+    p.add_argument('--max_grad_norm', default=0.0, type=float,
+                   help='Clip gradients to max_grad_norm during training, 0 '
+                        '(default) to disable.')
     p.add_argument('--num_train_epochs', default=50, type=int,
                    help='Number of training epochs.')
     p.add_argument('--patience', default=10, type=int,
@@ -158,6 +167,23 @@ def parse_args():
                    help='Maximum window width for the CNN model.')
     p.add_argument('--alphas', nargs='+', type=float, default=[0.5, 0.5],
                    help='alpha for each dataset in the MULT model')
+    p.add_argument('--num_buckets', default=0, type=int,
+                   help='Batch the training examples in this many buckets '
+                        'of similar lengths to reduce padding, 0 to disable')
+    p.add_argument('--fused_train_step', action='store_true', default=False,
+                   help='Take one gradient step on the alpha-weighted sum of '
+                        'the losses of all the datasets per training step '
+                        'in a single session run, instead of one step per '
+                        'dataset; needs one --alphas per dataset')
+    p.add_argument('--cache_predict_inputs', action='store_true',
+                   default=False,
+                   help='In predict mode, read the data to predict once and '
+                        'keep its batches in memory to feed every saved '
+                        'model, instead of reading it again per model')
+    p.add_argument('--in_graph_eval', action='store_true', default=False,
+                   help='Accumulate the evaluation results in the graph and '
+                        'only fetch the totals, instead of fetching the labels '
+                        'and predictions of every batch')
     p.add_argument('--class_sizes', nargs='+', type=int,
                    help='Number of classes for each dataset.')
     p.add_argument('--checkpoint_dir', type=str, default='./data/ckpt/',
@@ -193,16 +219,68 @@ def parse_args():
                         'Recall_Macro: macro-averaged recall score;\n'
                         'Precision_Macro: macro-averaged precision score.')
 
-    return p.parse_args()
+    args = p.parse_args(argv)
+    # zip() would leave the datasets without an alpha out of the fused loss
+    if args.fused_train_step and args.datasets is not None and \
+            len(args.alphas) != len(args.datasets):
+        p.error('--fused_train_step needs one alpha per dataset, got {} '
+                'alphas for {} datasets'.format(len(args.alphas),
+                                                len(args.datasets)))
+    return args
 
 
 def get_num_records(tf_record_filename):
+    if isinstance(tf_record_filename, (list, tuple)):
+        # all the shards of a split
+        return sum(get_num_records(f) for f in tf_record_filename)
     c = 0
     for _ in tf.python_io.tf_record_iterator(tf_record_filename):
         c += 1
     return c
 
 
+def get_tfrecord_files(dataset_path, split):
+    """Get the TFRecord file(s) of a split
+
+    :param dataset_path: path to the dataset's TFRecord files
+    :param split: 'train', 'valid' or 'test'
+    :return: list of the shards recorded in args.json, or [<split>.tf] if the
+        split was not written in shards
+    """
+    with open(os.path.join(dataset_path, 'args.json')) as file:
+        shards = json.load(file).get(split + '_shards')
+    if not shards:
+        return [os.path.join(dataset_path, split + '.tf')]
+    return [os.path.join(dataset_path, shard) for shard in shards]
+
+
+def get_bucket_boundaries(tf_record_filenames, length_keys, num_buckets):
+    """Get the boundaries of num_buckets buckets with about the same number
+    of training examples in each
+
+    :param tf_record_filenames: list, the training TFRecord files
+    :param length_keys: keys of the length features, the length of an example
+        is the max of them
+    :param num_buckets: number of buckets
+    :return: list of increasing bucket boundaries for Pipeline, empty(no
+        bucketing) if there are no training examples
+    """
+    lengths = []
+    for tf_record_filename in tf_record_filenames:
+        for record in tf.python_io.tf_record_iterator(tf_record_filename):
+            feature = tf.train.Example.FromString(record).features.feature
+            lengths.append(max(feature[key].int64_list.value[0]
+                               for key in length_keys))
+    if not lengths:
+        logging.warning('No training examples in %s, batching without '
+                        'buckets', tf_record_filenames)
+        return []
+    quantiles = np.percentile(lengths,
+                              np.linspace(0, 100, num_buckets + 1)[1:-1])
+    # examples as long as a quantile go to the lower bucket
+    return sorted(set(int(q) + 1 for q in quantiles))
+
+
 def get_vocab_size(dataset_paths):
     """Read the vocab_size in args.json in the TFRecord paths
 
@@ -218,6 +296,25 @@ def get_vocab_size(dataset_paths):
     return int(vocab_sizes[0])
 
 
+def get_checkpoint_variables(checkpoint_path):
+    """The global variables that are saved in the checkpoint
+
+    A checkpoint written with another optimizer(e.g. before --optimizer was
+    honored) doesn't have the learning rate variable and the optimizer slots
+    of this graph, which then keep their initial values when fine-tuning.
+    """
+    saved_names = set(name for name, _ in
+                      tf.train.list_variables(checkpoint_path))
+    var_list = []
+    for var in tf.global_variables():
+        if var.op.name in saved_names:
+            var_list.append(var)
+        else:
+            print('{} is not in the checkpoint, not restored'.format(
+                var.op.name))
+    return var_list
+
+
 def train_model(model,
                 dataset_info,
                 steps_per_epoch,
@@ -311,13 +408,22 @@ def train_model(model,
     global_step_tensor = tf.train.get_or_create_global_step()
 
     train_ops = dict()
-    optim = tf.train.RMSPropOptimizer(learning_rate=args.lr0)
-    for dataset_name in model_info:
-        # tvars, grads = get_var_grads(losses[dataset_name])
-        # train_ops[dataset_name] = get_train_op(tvars, grads, lr, args.max_grad_norm,
-        #                               global_step_tensor, args.optimizer, name='train_op_{}'.format(dataset_name))
-        train_ops[dataset_name] = optim.minimize(losses[dataset_name],
-                                                 global_step=global_step_tensor)
+    optim = Optimizer(global_step=global_step_tensor,
+                      config=get_optimizer_config(args))
+    if args.fused_train_step:
+        # one update on the alpha-weighted loss of all the datasets
+        fused_loss = tf.add_n([alpha * losses[dataset_name]
+                               for dataset_name, alpha in
+                               zip(args.datasets, args.alphas)])
+        fused_train_op = optim.minimize(fused_loss)
+    else:
+        for dataset_name in model_info:
+            # tvars, grads = get_var_grads(losses[dataset_name])
+            # train_ops[dataset_name] = get_train_op(tvars, grads, lr, args.max_grad_norm,
+            #                               global_step_tensor, args.optimizer, name='train_op_{}'.format(dataset_name))
+            train_ops[dataset_name] = optim.minimize(
+                losses[dataset_name],
+                name='train_op_{}'.format(dataset_name))
 
     # tvars, grads = get_var_grads(loss)
     # train_op = get_train_op(tvars, grads, lr, args.max_grad_norm,
@@ -333,6 +439,8 @@ def train_model(model,
     fill_eval_loss_op(args, model, dataset_info, model_info)
     fill_pred_op_info(dataset_info, model, args, model_info)
     fill_topic_op(args, model_info)
+    if args.in_graph_eval:
+        fill_eval_metric_ops(args, dataset_info, model_info)
 
     print("All the variables after defining valid/test accuracy:")
     all_variables = tf.global_variables()
@@ -352,6 +460,15 @@ def train_model(model,
     print("Total trainable parameters in this model={}\n\n\n".format(
         total_trainable_parameters))
 
+    print("Optimizer state of the variables({}):".format(args.optimizer))
+    total_state_bytes = 0
+    for var_name, var_bytes, state_bytes in optim.state_bytes():
+        print('{}: variable {:.2f}MB, optimizer state {:.2f}MB'.format(
+            var_name, var_bytes / 2 ** 20, state_bytes / 2 ** 20))
+        total_state_bytes += state_bytes
+    print("Total optimizer state={:.2f}MB\n\n\n".format(
+        total_state_bytes / 2 ** 20))
+
     # # Add ops to save and restore all the variables.
 
     # latest checkpoint
@@ -374,12 +491,17 @@ def train_model(model,
 
         if args.mode == 'train':
             sess.run(init_ops)
+            init_pretrained_embeddings(sess)
 
         else:
             assert len(args.datasets) == 1
             checkpoint_path_load = model_info[args.datasets[0]][
                 'checkpoint_path_load']
-            saver.restore(sess, checkpoint_path_load)
+            # the variables missing from the checkpoint are initialized by
+            # the session
+            restorer = tf.train.Saver(
+                var_list=get_checkpoint_variables(checkpoint_path_load))
+            restorer.restore(sess, checkpoint_path_load)
 
         if args.summaries_dir:
             train_file_writer = tf.summary.FileWriter(
@@ -435,21 +557,37 @@ def train_model(model,
             # average loss per batch (which is in turn averaged across examples)
             # train_loss = float(total_loss) / float(num_iter)
 
+            task_losses = {dataset_name: 0.0 for dataset_name in
+                           args.datasets}
             for _ in tqdm(xrange(steps_per_epoch)):
-                for (dataset_name, alpha) in zip(*[args.datasets, args.alphas]):
-                    loss_v, _ = sess.run(
-                        [losses[dataset_name], train_ops[dataset_name]])
-                    total_loss += alpha * loss_v
-                step = sess.run(global_step_tensor)
+                if args.fused_train_step:
+                    # all the datasets' losses come from the same run
+                    loss_vs, _ = sess.run([losses, fused_train_op])
+                    for dataset_name in args.datasets:
+                        task_losses[dataset_name] += loss_vs[dataset_name]
+                else:
+                    for dataset_name in args.datasets:
+                        loss_v, _ = sess.run(
+                            [losses[dataset_name], train_ops[dataset_name]])
+                        task_losses[dataset_name] += loss_v
                 num_iter += 1
             assert num_iter > 0
+            # only needed for the summaries, no need to fetch it every step
+            step = sess.run(global_step_tensor)
 
+            for (dataset_name, alpha) in zip(*[args.datasets, args.alphas]):
+                total_loss += alpha * task_losses[dataset_name]
             train_loss = float(total_loss) / float(num_iter)
 
             if args.summaries_dir:
                 train_loss_summary = tf.Summary(
                     value=[
                         tf.Summary.Value(tag="loss", simple_value=train_loss)])
+                for dataset_name in args.datasets:
+                    train_loss_summary.value.add(
+                        tag="loss-" + dataset_name,
+                        simple_value=float(task_losses[dataset_name]) / float(
+                            num_iter))
                 train_file_writer.add_summary(
                     train_loss_summary, global_step=step)
 
@@ -475,10 +613,14 @@ def train_model(model,
                                                             'labels'],
                                                         args=args,
                                                         get_topic_op=_get_topic_op,
-                                                        topic_path=dataset_info[
+                                                        topic_ids=dataset_info[
                                                             dataset_name][
-                                                            'topic_path'],
-                                                        eval_loss_op=_loss_op)
+                                                            'topic_ids'],
+                                                        eval_loss_op=_loss_op,
+                                                        eval_metric_ops=
+                                                        model_info[
+                                                            dataset_name].get(
+                                                            'valid_metric_ops'))
                 model_info[dataset_name]['valid_metrics'] = _metrics
 
             end_time = time()
@@ -663,6 +805,8 @@ def test_model(model, dataset_info, args):
     print("filled pred op")
     fill_topic_op(args, model_info)
     print("filled topic op")
+    if args.in_graph_eval:
+        fill_eval_metric_ops(args, dataset_info, model_info)
 
     str_ = '\n' + args.tuning_metric + ' on the held-out test data using different saved models:'
 
@@ -712,14 +856,18 @@ def test_model(model, dataset_info, args):
                                                             'labels'],
                                                         args=args,
                                                         get_topic_op=_get_topic_op,
-                                                        topic_path=
+                                                        topic_ids=
                                                         dataset_info[
                                                             dataset_name][
-                                                            'topic_path'],
+                                                            'topic_ids'],
                                                         eval_loss_op=
                                                         model_info[
                                                             dataset_name][
-                                                            'test_loss_op'])
+                                                            'test_loss_op'],
+                                                        eval_metric_ops=
+                                                        model_info[
+                                                            dataset_name].get(
+                                                            'test_metric_ops'))
                 model_info[dataset_name]['test_metrics'] = _metrics
 
                 _num_eval_total = model_info[dataset_name]['test_metrics'][
@@ -774,8 +922,8 @@ def predict(model, dataset_info, args):
     fill_pred_op_info(dataset_info, model, args, model_info)
     # fill_topic_op(args, model_info)
 
-    str_ = 'Predictions of the given text data of dataset %s using different ' \
-           'saved models:' % args.predict_dataset
+    logging.info('Predictions of the given text data of dataset %s using '
+                 'different saved models:', args.predict_dataset)
     labels = [str(i) for i in dataset_info[args.predict_dataset]['labels']]
     if len(labels) == 2 or args.task == 'regression':
         # TODO currently just hard code for binary
@@ -785,20 +933,28 @@ def predict(model, dataset_info, args):
 
     saver = tf.train.Saver(max_to_keep=100)
 
-    model_names = args.datasets
+    model_names = list(args.datasets)
     if len(args.datasets) > 1:
         model_names.append('MULT')
 
-    for model_name in model_names:
-        # load the saved best model
-        str_ += '\nUsing the model that performs the best on (%s)\n' % model_name
+    dataset_name = args.predict_dataset
+    _pred_op = model_info[dataset_name]['pred_pred_op']
+    _pred_iter = model_info[dataset_name]['pred_iter']
+    _pred_batch = model_info[dataset_name]['pred_batch']
 
-        output = header
-        str_ += header
+    make_dir(args.predict_output_folder)
 
-        data = []
+    # one session for all the saved models, restoring a checkpoint only
+    # overwrites the values of the variables
+    with tf.Session() as sess:
+        batches = None
+        if args.cache_predict_inputs:
+            # read the predict data through the pipeline once and feed the
+            # cached batches to every saved model
+            batches = get_all_batches(sess, _pred_batch, _pred_iter)
 
-        with tf.Session() as sess:
+        for model_name in model_names:
+            # load the saved best model
             if model_name == 'MULT':
                 checkpoint_path = os.path.join(args.checkpoint_dir, 'MULT',
                                                'model')
@@ -807,55 +963,67 @@ def predict(model, dataset_info, args):
 
             saver.restore(sess, checkpoint_path)
 
-            dataset_name = args.predict_dataset
-
-            # import pdb
-            # sess.run(model_info[dataset_name]['pred_iter'].initializer)
-            # batch = model_info[dataset_name]['pred_batch']
-            # text, weights = sess.run([batch['text'], batch['text_weights']])
-            # pdb.set_trace()
-
-            _pred_op = model_info[dataset_name]['pred_pred_op']
-            _pred_iter = model_info[dataset_name]['pred_iter']
-            _ids, _predictions, _scores = get_all_pred_res(sess, _pred_op,
-                                                           _pred_iter, args)
-
-            for id, pred, score in zip(_ids, _predictions, _scores):
-                record = {
-                    'id': id,
-                    'label': pred
-                }
-                if args.task == 'classification':
-                    for l, s in zip(labels, score):
-                        record[str(l)] = s
-                else:
-                    record['score'] = score[0]
-                data.append(record)
-
-                # output positive score for binary classification
-
-                if len(score) == 2:
-                    score = str(score[1])
-                else:
-                    score = '\t'.join([str(i) for i in score])
-                str_ += id + '\t' + str(int(pred)) + '\t' + score + '\n'
-                output += id + '\t' + str(int(pred)) + '\t' + score + '\n'
-
-            make_dir(args.predict_output_folder)
-
-            with open(
-                os.path.join(args.predict_output_folder, model_name) + '.tsv',
-                'w') as file:
-                # for i in _predictions:
-                #   file.write(str(i))
-                file.write(output)
-
-            with open(
-                os.path.join(args.predict_output_folder, model_name) + '.json',
-                'wt') as file:
-                json.dump(data, file, ensure_ascii=False)
+            tsv_path = os.path.join(args.predict_output_folder,
+                                    model_name) + '.tsv'
+            json_path = os.path.join(args.predict_output_folder,
+                                     model_name) + '.json'
+            num_records = 0
+
+            # stream the predictions to the output files batch by batch
+            with open(tsv_path, 'w') as tsv_file, \
+                    open(json_path, 'wt') as json_file:
+                tsv_file.write(header)
+                json_file.write('[')
+
+                for _ids, _predictions, _scores in iter_pred_res(
+                        sess, _pred_op, _pred_iter, args, _pred_batch,
+                        batches):
+                    lines = []
+                    for id, pred, score in zip(_ids, _predictions, _scores):
+                        record = {
+                            'id': id,
+                            'label': pred
+                        }
+                        if args.task == 'classification':
+                            for l, s in zip(labels, score):
+                                record[str(l)] = s
+                        else:
+                            record['score'] = score[0]
+                        if num_records:
+                            json_file.write(', ')
+                        json_file.write(json.dumps(record, ensure_ascii=False))
+                        num_records += 1
+
+                        # output positive score for binary classification
+
+                        if len(score) == 2:
+                            score = str(score[1])
+                        else:
+                            score = '\t'.join([str(i) for i in score])
+                        lines.append(
+                            id + '\t' + str(int(pred)) + '\t' + score + '\n')
+                    tsv_file.write(''.join(lines))
+
+                json_file.write(']')
+
+            logging.info('Wrote %d predictions of the model that performs '
+                         'the best on (%s) to %s and %s', num_records,
+                         model_name, tsv_path, json_path)
+
+
+def get_all_batches(session, batch, iterator):
+    """Evaluate all the batches of an iterator, used to feed the same input
+    to several checkpoints without reading it again"""
+    session.run(iterator.initializer)
+
+    batches = []
+    while True:
+        try:
+            batches.append(session.run(batch))
+        except tf.errors.OutOfRangeError:
+            break
 
-    logging.info(str_)
+    return batches
 
 
 def get_all_predictions(session, pred_op, pred_iterator):
@@ -879,34 +1047,171 @@ def get_all_pred_res(session, pred_op, pred_iterator, args):
     (id, predicted label and softmax values for each class)
     used for predict mode only
     """
-    session.run(pred_iterator.initializer)
-
     ids = []
     predictions = []
     scores = []
+    for id_list, pred_class_list, score_list in iter_pred_res(
+            session, pred_op, pred_iterator, args):
+        ids += id_list  # TODO bytes to string
+        predictions += pred_class_list
+        scores += score_list
+
+    return ids, predictions, scores
+
+
+def iter_pred_res(session, pred_op, pred_iterator, args, batch=None,
+                  batches=None):
+    """Yield the predict results batch by batch
+
+    If batches(the values of batch returned by get_all_batches()) is given,
+    they are fed to pred_op instead of reading the iterator again.
+    """
+    if batches is None:
+        session.run(pred_iterator.initializer)
+
+    batch_index = 0
     while True:
         try:
-            id, pred_class, score = session.run(pred_op)
-            id_list = [i.decode('utf-8') for i in id.tolist()]
-            score_list = score.tolist()
-            if args.task == 'regression':
-                pred_class_list, score_list = score_to_prediction(score_list,
-                                                                  args.pos_cut)
-            else:  # classification
-                pred_class_list = pred_class.tolist()
-            ids += id_list  # TODO bytes to string
-            predictions += pred_class_list
-            scores += score_list
+            if batches is None:
+                id, pred_class, score = session.run(pred_op)
+            elif batch_index < len(batches):
+                id, pred_class, score = session.run(
+                    pred_op,
+                    feed_dict={batch[k]: v for k, v in batches[batch_index].items()})
+            else:
+                break
+            batch_index += 1
         except tf.errors.OutOfRangeError:
             break
 
-    return ids, predictions, scores
+        id_list = [i.decode('utf-8') for i in id.tolist()]
+        score_list = score.tolist()
+        if args.task == 'regression':
+            pred_class_list, score_list = score_to_prediction(score_list,
+                                                              args.pos_cut)
+        else:  # classification
+            pred_class_list = pred_class.tolist()
+        yield id_list, pred_class_list, score_list
 
 
 def get_topic(batch):
     return batch['index']
 
 
+def load_topic_ids(topic_path, topic_field_name):
+    """Map the examples' indices to the ids of their topics, done once
+
+    :param topic_path: gzipped json file of the examples(often data.json.gz)
+    :param topic_field_name: key of the field representing the topics
+    :return: array topic_ids, topic_ids[index] is the id of the topic of the
+    example with the index(-1 if no such example), or None if the file
+    can't be read
+    """
+    if topic_path == '' or topic_path is None:
+        return None
+
+    with gzip.open(topic_path, mode='rt') as f:
+        try:
+            d = json.load(f, encoding='utf-8')
+        except UnicodeDecodeError:
+            print("Failed to read topic_path={}".format(topic_path))
+            names = ["topic2", "topic-2", "topic5", "topic-5"]
+            if any(name in topic_path.lower() for name in names):
+                # Topic-2 and Topic-5 require examples' topics to compute metric,
+                # so we need to read their corresponding files
+                raise
+            return None
+
+    if not d:
+        return None
+    indices = np.array([item['index'] for item in d], dtype=np.int64)
+    topics = [item[topic_field_name] for item in d]
+    _, ids = np.unique(topics, return_inverse=True)
+    topic_ids = np.full(indices.max() + 1, -1, dtype=np.int64)
+    topic_ids[indices] = ids
+    return topic_ids
+
+
+def get_eval_metric_ops(labels, predictions, loss, num_classes, task,
+                        indices=None, topic_ids=None, pos_cut=0.5,
+                        name='eval_metrics'):
+    """Accumulate the evaluation results in the graph
+
+    The confusion counts, the loss and the squared error are kept in local
+    variables, so evaluating a batch with update_op transfers nothing back to
+    Python and only the final accumulators are fetched.
+
+    :param labels: gold labels of the batch
+    :param predictions: predictions of the batch
+    :param loss: mean loss of the batch
+    :param num_classes: number of classes
+    :param task: classification or regression, regression scores are
+    binarized at pos_cut
+    :param indices: indices of the examples of the batch
+    :param topic_ids: topic id of each example index from load_topic_ids(),
+    None to count all the examples as one topic
+    :return: dict of reset_op, update_op and the accumulators, counts[t, i,
+    j] is the number of examples of topic t in class i predicted as class j
+    """
+    with tf.variable_scope(name):
+        if task == 'classification':
+            label_classes = tf.cast(labels, tf.int64)
+            pred_classes = tf.cast(predictions, tf.int64)
+            squared_error = tf.constant(0.0, dtype=tf.float64)
+        else:
+            num_classes = 2
+            label_classes = tf.cast(labels >= pos_cut, tf.int64)
+            pred_classes = tf.cast(predictions >= pos_cut, tf.int64)
+            squared_error = tf.reduce_sum(tf.square(
+                tf.cast(labels, tf.float64) - tf.cast(predictions, tf.float64)))
+
+        def _local_variable(var_name, shape, dtype):
+            return tf.Variable(tf.zeros(shape, dtype=dtype),
+                               name=var_name,
+                               trainable=False,
+                               collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+        label_classes = tf.reshape(label_classes, [-1])
+        pred_classes = tf.reshape(pred_classes, [-1])
+        if topic_ids is not None:
+            num_topics = int(topic_ids.max()) + 1
+            topics = tf.gather(tf.constant(topic_ids), indices)
+            topics = tf.reshape(topics, [-1])
+            # no example may fall outside of the counts
+            with tf.control_dependencies(
+                    [tf.assert_non_negative(topics)]):
+                topics = tf.identity(topics)
+        else:
+            num_topics = 1
+            topics = tf.zeros_like(label_classes)
+        cells = (topics * num_classes + label_classes) * num_classes
+        cells += pred_classes
+
+        counts = _local_variable('confusion_counts',
+                                 [num_topics, num_classes, num_classes],
+                                 tf.int64)
+        loss_sum = _local_variable('loss_sum', [], tf.float64)
+        squared_error_sum = _local_variable('squared_error_sum', [],
+                                            tf.float64)
+
+        update_op = tf.group(
+            tf.assign_add(counts, tf.reshape(
+                tf.unsorted_segment_sum(tf.ones_like(cells), cells,
+                                        num_topics * num_classes * num_classes),
+                [num_topics, num_classes, num_classes])),
+            tf.assign_add(loss_sum, tf.cast(loss, tf.float64)),
+            tf.assign_add(squared_error_sum, squared_error),
+            name='update_op')
+        reset_op = tf.variables_initializer(
+            [counts, loss_sum, squared_error_sum], name='reset_op')
+
+    return {'reset_op': reset_op,
+            'update_op': update_op,
+            'counts': counts,
+            'loss_sum': loss_sum,
+            'squared_error_sum': squared_error_sum}
+
+
 def compute_held_out_performance(session,
                                  pred_op,
                                  eval_label,
@@ -915,113 +1220,97 @@ def compute_held_out_performance(session,
                                  labels,
                                  args,
                                  get_topic_op,
-                                 topic_path,
-                                 eval_loss_op):
+                                 topic_ids,
+                                 eval_loss_op,
+                                 eval_metric_ops=None):
     # pred_op: predicted labels
     # eval_label: gold labels
+    # topic_ids: topic id of each example index from load_topic_ids(), None
+    # if the metrics don't need the topics
+    # eval_metric_ops: in-graph accumulators from get_eval_metric_ops()
 
     # Initialize eval iterator
     session.run(eval_iterator.initializer)
 
-    d = None
-
-    if args.experiment_name == 'RUDER_NAACL_18':
-        if topic_path != '' and topic_path is not None:
-            with gzip.open(topic_path, mode='rt') as f:
-                try:
-                    d = json.load(f, encoding='utf-8')
-                except UnicodeDecodeError:
-                    print("Failed to read topic_path={}".format(topic_path))
-                    d = None
-                    names = ["topic2", "topic-2", "topic5", "topic-5"]
-                    if any(name in topic_path.lower() for name in names):
-                        # Topic-2 and Topic-5 require examples' topics to compute metric,
-                        # so we need to read their corresponding files
-                        raise
-
-    if d is not None:
-        index2topic = dict()
-        for item in d:
-            index2topic[item['index']] = item[args.topic_field_name]
+    # regression scores are binarized at pos_cut
+    pos_cut = 0.5
+    if args.task == 'classification':
+        streaming_metrics = StreamingMetrics(labels)
     else:
-        index2topic = None
-
-    # Accumulate predictions
-    y_trues = []
-    y_preds = []
-    y_indexes = []
-    y_topics = []
-    total_eval_loss = 0
+        streaming_metrics = StreamingMetrics([0, 1])
     num_eval_iter = 0
-    while True:
-        try:
-            y_true, y_pred, y_index, eval_loss_v = session.run(
-                [eval_label, pred_op, get_topic_op, eval_loss_op])
-            num_eval_iter += 1
-            total_eval_loss += eval_loss_v
-            y_index = y_index.tolist()  # index of example in data.json
-            if index2topic is not None:
-                y_topic = [index2topic[idx] for idx in
-                           y_index]  # topic for each example so we can macro-average across topics
-            else:
-                y_topic = []
-            y_indexes += y_index
-            y_topics += y_topic
 
-            assert y_true.shape == y_pred.shape
-            y_trues += y_true.tolist()
-            y_preds += y_pred.tolist()
-        except tf.errors.OutOfRangeError:
-            break
+    if eval_metric_ops is not None:
+        # Accumulate in the graph and only fetch the final accumulators
+        session.run(eval_metric_ops['reset_op'])
+        while True:
+            try:
+                session.run(eval_metric_ops['update_op'])
+                num_eval_iter += 1
+            except tf.errors.OutOfRangeError:
+                break
+        counts, total_eval_loss, squared_error = session.run(
+            [eval_metric_ops['counts'],
+             eval_metric_ops['loss_sum'],
+             eval_metric_ops['squared_error_sum']])
+        if topic_ids is not None:
+            for topic, topic_counts in enumerate(counts):
+                streaming_metrics.add_confusion_matrix(topic_counts, topic)
+        else:
+            streaming_metrics.add_confusion_matrix(counts[0])
+
+    else:
+        # Accumulate predictions batch by batch into the confusion counts
+        squared_error = 0.0
+        total_eval_loss = 0
+        while True:
+            try:
+                y_true, y_pred, y_index, eval_loss_v = session.run(
+                    [eval_label, pred_op, get_topic_op, eval_loss_op])
+                num_eval_iter += 1
+                total_eval_loss += eval_loss_v
+                # y_index: index of example in data.json
+                if topic_ids is not None:
+                    # topic for each example so we can macro-average across
+                    # topics
+                    y_topic = topic_ids[y_index]
+                    assert np.all(y_topic >= 0), 'Examples without topics!'
+                else:
+                    y_topic = None
+
+                assert y_true.shape == y_pred.shape
+                if args.task == 'classification':
+                    streaming_metrics.update(y_true, y_pred, y_topic)
+                elif args.task == 'regression':
+                    squared_error += np.sum(
+                        np.square(y_true.astype(np.float64) - y_pred))
+                    streaming_metrics.update(
+                        (y_true >= pos_cut).astype(np.int64),
+                        (y_pred >= pos_cut).astype(np.int64),
+                        y_topic)
+            except tf.errors.OutOfRangeError:
+                break
 
     assert num_eval_iter > 0, num_eval_iter
     evaluation_loss = float(total_eval_loss) / float(num_eval_iter)
 
-    ntotal = len(y_trues)
+    ntotal = streaming_metrics.ntotal
+    ncorrect = streaming_metrics.accurate_number()
 
+    scores = dict()
     if args.task == 'classification':
-        scores = dict()
         for metric in metrics:
-            func = metric2func(metric)
-            scores[metric] = func(y_trues, y_preds, labels, y_topics)
-
-        ncorrect = accurate_number(y_trues=y_trues,
-                                   y_preds=y_preds,
-                                   labels=labels,
-                                   topics=y_topics)
+            scores[metric] = streaming_metrics.score(metric)
 
     elif args.task == 'regression':
 
         # TODO convert for accurate number
-        pos_cut = 0.5
-        y_true_classes = []
-        y_pred_classes = []
-        for i, y_true in enumerate(y_trues):
-            if y_true < pos_cut:
-                y_true_classes.append(0)
-            else:
-                y_true_classes.append(1)
-
-        for i, y_pred in enumerate(y_preds):
-            if y_pred < pos_cut:
-                y_pred_classes.append(0)
-            else:
-                y_pred_classes.append(1)
-
-        scores = dict()
-
         for metric in metrics:
-            func = metric2func('MSE')
             if metric == 'MSE':
-                scores[metric] = func(y_trues, y_preds, labels, y_topics)
+                scores[metric] = squared_error / ntotal
             else:
-                scores[metric] = func(
-                    y_true_classes, y_pred_classes, labels, y_topics)
-
-        ncorrect = accurate_number(y_trues=y_true_classes,
-                                   y_preds=y_pred_classes,
-                                   labels=labels,
-                                   topics=y_topics)
+                # MSE of the binarized classes
+                scores[metric] = 1.0 - streaming_metrics.accuracy_score()
 
     res = dict()
     res['ntotal'] = ntotal
@@ -1094,6 +1383,12 @@ def main():
             'dataset_name'] = dataset_name  # feature name is just dataset name
         dataset_info[dataset_name]['dir'] = dirs[dataset_name]
         dataset_info[dataset_name]['topic_path'] = topic_paths[dataset_name]
+        # read the topics once for all the evaluations
+        if args.experiment_name == 'RUDER_NAACL_18':
+            dataset_info[dataset_name]['topic_ids'] = load_topic_ids(
+                topic_paths[dataset_name], args.topic_field_name)
+        else:
+            dataset_info[dataset_name]['topic_ids'] = None
         dataset_info[dataset_name]['class_size'] = class_sizes[dataset_name]
         dataset_info[dataset_name]['ordering'] = ordering[dataset_name]
         dataset_info[dataset_name]['labels'] = labels[dataset_name]
@@ -1102,14 +1397,14 @@ def main():
         _dir = dataset_info[dataset_name]['dir']
 
         # Set paths to TFRecord files
-        _dataset_train_path = os.path.join(_dir, "train.tf")
+        _dataset_train_path = get_tfrecord_files(_dir, 'train')
         dataset_info[dataset_name]['train_path'] = _dataset_train_path
 
         if args.mode in ['train', 'finetune']:
-            _dataset_valid_path = os.path.join(_dir, "valid.tf")
+            _dataset_valid_path = get_tfrecord_files(_dir, 'valid')
             dataset_info[dataset_name]['valid_path'] = _dataset_valid_path
         elif args.mode == 'test':
-            _dataset_test_path = os.path.join(_dir, "test.tf")
+            _dataset_test_path = get_tfrecord_files(_dir, 'test')
             dataset_info[dataset_name]['test_path'] = _dataset_test_path
         elif args.mode == 'predict':
             _dataset_predict_path = args.predict_tfrecord_path
@@ -1144,9 +1439,22 @@ def main():
                     FEATURES[text_field_name + '_bow'] = tf.FixedLenFeature(
                         [vocab_size],
                         dtype=tf.float32)
+                elif args.input_key == 'sparse_bow':
+                    # the bag of words is built from the types in the model
+                    FEATURES[text_field_name + '_types'] = tf.VarLenFeature(
+                        dtype=tf.int64)
+                    FEATURES[
+                        text_field_name + '_type_counts'] = tf.VarLenFeature(
+                        dtype=tf.int64)
                 elif args.input_key == 'tfidf':
-                    FEATURES[text_field_name + '_tfidf'] = tf.FixedLenFeature(
-                        [vocab_size], dtype=tf.float32)
+                    # sparse, the tf-idf values are aligned with the types
+                    FEATURES[text_field_name + '_types'] = tf.VarLenFeature(
+                        dtype=tf.int64)
+                    FEATURES[
+                        text_field_name + '_type_counts'] = tf.VarLenFeature(
+                        dtype=tf.int64)
+                    FEATURES[text_field_name + '_tfidf'] = tf.VarLenFeature(
+                        dtype=tf.float32)
                 # elif args.input_key == 'unique':
                 #   FEATURES[text_field_name + '_unique'] = tf.VarLenFeature(
                 #       dtype=tf.int64)
@@ -1179,8 +1487,22 @@ def main():
         # examples from serialized TF record files.
         for dataset_name in dataset_info:
             _train_path = dataset_info[dataset_name]['train_path']
+            bucket_boundaries, bucket_length_keys = None, None
+            if args.num_buckets > 1 and args.mode in ['train', 'finetune']:
+                with open(os.path.join(dataset_info[dataset_name]['dir'],
+                                       'args.json')) as f:
+                    bucket_length_keys = [
+                        text_field_name + '_length' for text_field_name in
+                        json.load(f)['text_field_names']]
+                bucket_boundaries = get_bucket_boundaries(_train_path,
+                                                          bucket_length_keys,
+                                                          args.num_buckets)
+                logging.info("Bucket boundaries of %s: %s", dataset_name,
+                             bucket_boundaries)
             ds = build_input_dataset(_train_path, FEATURES, args.batch_size,
-                                     is_training=True)
+                                     is_training=True,
+                                     bucket_boundaries=bucket_boundaries,
+                                     bucket_length_keys=bucket_length_keys)
             dataset_info[dataset_name]['train_dataset'] = ds
 
             if args.mode in ['train', 'finetune']:
@@ -1281,6 +1603,18 @@ def set_hps(args):
     return hParams
 
 
+def get_optimizer_config(args):
+    config = Optimizer.H()
+    config.optimizer = args.optimizer
+    config.lr = args.lr0
+    config.max_grad_norm = args.max_grad_norm
+    config.adafactor_slot_dtype = args.optimizer_slot_dtype
+    # the RMSProp hyperparameters the driver has always trained with
+    config.rmsprop_momentum = 0.0
+    config.rmsprop_epsilon = 1e-10
+    return config
+
+
 def get_learning_rate(learning_rate):
     return tf.constant(learning_rate)
 
@@ -1549,6 +1883,25 @@ def fill_eval_loss_op(args, model, dataset_info, model_info):
             model_info[dataset_name]['test_loss_op'] = _test_loss_op
 
 
+def fill_eval_metric_ops(args, dataset_info, model_info):
+    for dataset_name in model_info:
+        if args.mode in ['train', 'finetune']:
+            split = 'valid'
+        elif args.mode == 'test':
+            split = 'test'
+        else:
+            continue
+        model_info[dataset_name][split + '_metric_ops'] = get_eval_metric_ops(
+            model_info[dataset_name][split + '_batch'][args.label_key],
+            model_info[dataset_name][split + '_pred_op'],
+            model_info[dataset_name][split + '_loss_op'],
+            num_classes=dataset_info[dataset_name]['class_size'],
+            task=args.task,
+            indices=model_info[dataset_name][split + '_topic_op'],
+            topic_ids=dataset_info[dataset_name]['topic_ids'],
+            name='{}_metrics_{}'.format(split, dataset_name))
+
+
 def fill_topic_op(args, model_info):
     for dataset_name in model_info:
         if args.mode in ['train', 'finetune']:
@@ -1564,10 +1917,13 @@ def fill_topic_op(args, model_info):
 
 
 def build_input_dataset(tfrecord_path, batch_features, batch_size,
-                        is_training=True):
+                        is_training=True, bucket_boundaries=None,
+                        bucket_length_keys=None):
     if is_training:
         ds = Pipeline(tfrecord_path, batch_features, batch_size,
                       num_epochs=None,  # repeat indefinitely
+                      bucket_boundaries=bucket_boundaries,
+                      bucket_length_keys=bucket_length_keys
                       )
     else:
         ds = Pipeline(tfrecord_path, batch_features, batch_size,
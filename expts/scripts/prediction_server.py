@@ -0,0 +1,156 @@
+#! /usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Serve the predictions of a trained model over HTTP
+
+The graph is built and the checkpoint restored once at startup. Concurrent
+requests are coalesced into micro-batches of at most --max_batch_size
+examples, waiting at most --max_wait_ms for a batch to fill up.
+
+Usage: python prediction_server.py --port 8000 --max_batch_size 32
+    --max_wait_ms 5 [arguments of discriminative_driver.py used to train
+    the model, --mode and --predict_dataset are not needed]
+
+Endpoints:
+    POST /predict: body is one example, either a json object with the text
+        field(s) and optionally an id, or {"text": "..."} for the first
+        text field; returns
+        {"id": ..., "label": ..., "scores": [...]}
+    GET /stats: request, batch, latency and throughput counters
+    GET /health
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse as ap
+import json
+import os
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from discriminative_driver import parse_args, set_hps
+from mtl.util.predictor import MicroBatcher, Predictor
+
+
+def parse_server_args():
+    p = ap.ArgumentParser()
+    p.add_argument('--host', type=str, default='127.0.0.1',
+                   help='Address to listen on.')
+    p.add_argument('--port', type=int, default=8000,
+                   help='Port to listen on.')
+    p.add_argument('--max_batch_size', type=int, default=32,
+                   help='Maximum number of requests predicted in one batch.')
+    p.add_argument('--max_wait_ms', type=float, default=5,
+                   help='Maximum time in milliseconds to wait for a batch to '
+                        'fill up after its first request arrives.')
+    p.add_argument('--serve_dataset', type=str, default=None,
+                   help='Dataset whose labels are predicted, defaults to the '
+                        'first of --datasets.')
+    p.add_argument('--serve_model', type=str, default=None,
+                   help='Which saved model to use, a dataset name or MULT, '
+                        'defaults to --serve_dataset.')
+    server_args, driver_argv = p.parse_known_args()
+    if '--mode' not in driver_argv:
+        driver_argv += ['--mode', 'predict']
+    return server_args, parse_args(driver_argv)
+
+
+class PredictionServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, batcher):
+        HTTPServer.__init__(self, address, PredictionHandler)
+        self.batcher = batcher
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.server.batcher.stats())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found: %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json(404, {'error': 'not found: %s' % self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            example = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(example, dict):
+                raise ValueError('expected a json object')
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        try:
+            label, scores = self.server.batcher.predict(example)
+        except (KeyError, ValueError) as e:
+            self.send_json(400, {'error': repr(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': repr(e)})
+            return
+        self.send_json(200, {'id': example.get('id'),
+                             'label': label,
+                             'scores': scores})
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # the counters in /stats replace the per-request log lines
+        pass
+
+
+def main():
+    server_args, args = parse_server_args()
+
+    dataset_name = server_args.serve_dataset or args.datasets[0]
+    model_name = server_args.serve_model or dataset_name
+    checkpoint_path = os.path.join(args.checkpoint_dir, model_name, 'model')
+
+    predictor = Predictor(set_hps(args), dataset_name, checkpoint_path)
+    batcher = MicroBatcher(predictor.predict,
+                           max_batch_size=server_args.max_batch_size,
+                           max_wait_ms=server_args.max_wait_ms)
+
+    server = PredictionServer((server_args.host, server_args.port), batcher)
+    print('Serving predictions of dataset %s with model %s on http://%s:%d'
+          % (dataset_name, checkpoint_path, server_args.host,
+             server_args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        predictor.close()
+        print(json.dumps(batcher.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,12 @@ def main(argv):
     if 'vocab_all' in args:
         vocab_all = args['vocab_all']
 
+    num_workers = args.get('num_workers', 1)
+    token_cache = args.get('token_cache', False)
+    token_cache_dir = args.get('token_cache_dir', None)
+    stream_data = args.get('stream_data', False)
+    num_shards = args.get('num_shards', 1)
+
     tfrecord_dir_name = \
         "min_" + str(args['min_frequency']) + \
         "_max_" + str(args['max_frequency']) + \
@@ -84,7 +90,12 @@ def main(argv):
                                   write_bow=args['write_bow'],
                                   write_tfidf=args['write_tfidf'],
                                   preproc=preproc,
-                                  vocab_all=vocab_all)
+                                  vocab_all=vocab_all,
+                                  num_workers=num_workers,
+                                  token_cache=token_cache,
+                                  token_cache_dir=token_cache_dir,
+                                  stream_data=stream_data,
+                                  num_shards=num_shards)
     else:
         vocab_path = args['pretrained_file']
         vocab_dir = os.path.dirname(vocab_path)
@@ -104,7 +115,8 @@ def main(argv):
             tfrecord_dir_name + '_' +
             vocab_name[:max(vocab_name.find('.txt'),
                             vocab_name.find('.bin.gz'),
-                            vocab_name.find('.vec.zip'))] + suffix)
+                            vocab_name.find('.vec.zip'),
+                            vocab_name.find('.npy'))] + suffix)
 
         tfrecord_dirs = [os.path.join(tfrecord_dir, dataset) for dataset in
                          datasets]
@@ -141,7 +153,12 @@ def main(argv):
                                       expand_vocab=expand_vocab,
                                       pretrained_only=pretrained_only,
                                       preproc=preproc,
-                                      vocab_all=vocab_all)
+                                      vocab_all=vocab_all,
+                                      num_workers=num_workers,
+                                      token_cache=token_cache,
+                                      token_cache_dir=token_cache_dir,
+                                      stream_data=stream_data,
+                                      num_shards=num_shards)
 
     return tfrecord_dir
 
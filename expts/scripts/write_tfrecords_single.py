@@ -48,6 +48,12 @@ def main():
     if 'vocab_all' in args:
         vocab_all = args['vocab_all']
 
+    num_workers = args.get('num_workers', 1)
+    token_cache = args.get('token_cache', False)
+    token_cache_dir = args.get('token_cache_dir', None)
+    stream_data = args.get('stream_data', False)
+    num_shards = args.get('num_shards', 1)
+
     tfrecord_dir_name = \
         "min_" + str(args['min_frequency']) + \
         "_max_" + str(args['max_frequency']) + \
@@ -83,7 +89,12 @@ def main():
                           vocab_given=False,
                           generate_tf_record=True,
                           preproc=preproc,
-                          vocab_all=vocab_all)
+                          vocab_all=vocab_all,
+                          num_workers=num_workers,
+                          token_cache=token_cache,
+                          token_cache_dir=token_cache_dir,
+                          stream_data=stream_data,
+                          num_shards=num_shards)
     else:
         vocab_path = args['pretrained_file']
         vocab_dir = os.path.dirname(vocab_path)
@@ -104,7 +115,8 @@ def main():
             tfrecord_dir_name + '_' +
             vocab_name[:max(vocab_name.find('.txt'),
                             vocab_name.find('.bin.gz'),
-                            vocab_name.find('.vec.zip'))] + suffix)
+                            vocab_name.find('.vec.zip'),
+                            vocab_name.find('.npy'))] + suffix)
 
         dataset = Dataset(json_dir=json_dir,
                           tfrecord_dir=tfrecord_dir,
@@ -132,7 +144,12 @@ def main():
                           expand_vocab=expand_vocab,
                           pretrained_only=pretrained_only,
                           preproc=preproc,
-                          vocab_all=vocab_all)
+                          vocab_all=vocab_all,
+                          num_workers=num_workers,
+                          token_cache=token_cache,
+                          token_cache_dir=token_cache_dir,
+                          stream_data=stream_data,
+                          num_shards=num_shards)
 
     with open(os.path.join(tfrecord_dir, 'vocab_size.txt'), 'w') as f:
         f.write(str(dataset.vocab_size))
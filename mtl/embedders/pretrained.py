@@ -19,20 +19,62 @@ from __future__ import print_function
 
 import codecs
 import json
+import weakref
 
 import numpy as np
 import tensorflow as tf
-# TODO other word embeddings
-from tqdm import tqdm
 
+# TODO other word embeddings
 from mtl.embedders.embed_sequence import get_weighted_embeddings
-from mtl.util.load_embeds import (load_pretrained_matrix,
-                                  load_pretrianed_vocab_dict)
+from mtl.util.load_embeds import (get_pretrained_matrix,
+                                  get_pretrained_rows,
+                                  get_pretrained_shape)
+
+# graph -> list of (variable, placeholder, assign op, value) of the
+# pretrained embedding variables to initialize; kept out of the graph
+# collections, which are serialized with the meta graph and would keep the
+# values alive as long as the graph
+_PRETRAINED_INIT = weakref.WeakKeyDictionary()
 
 
 # TODO refactor
 
 
+def get_pretrained_variable(name, matrix, trainable):
+    """Create an embedding variable whose initial value is matrix
+
+    The value is not baked into the graph as a constant: the variable is
+    zero-initialized and init_pretrained_embeddings() assigns the value
+    through a placeholder once the variables are initialized.
+    """
+    variable = tf.get_variable(name=name,
+                               initializer=tf.zeros_initializer(),
+                               dtype=tf.float32,
+                               shape=matrix.shape,
+                               trainable=trainable)
+    pending = _PRETRAINED_INIT.setdefault(variable.graph, [])
+    # the variable is shared when the embedder is called again
+    if not any(variable is v for v, _, _, _ in pending):
+        placeholder = tf.placeholder(tf.float32, shape=matrix.shape,
+                                     name=name + '_value')
+        assign_op = tf.assign(variable, placeholder)
+        pending.append((variable, placeholder, assign_op, matrix))
+    return variable
+
+
+def init_pretrained_embeddings(session):
+    """Assign the pretrained values to the embedding variables created by
+    get_pretrained_variable() in the session's graph, run after initializing
+    the variables; the values are released afterwards"""
+    pending = _PRETRAINED_INIT.pop(session.graph, [])
+    for variable, placeholder, assign_op, matrix in pending:
+        tf.logging.info('Initializing %s from the pretrained embeddings' %
+                        variable.name)
+        session.run(assign_op,
+                    feed_dict={placeholder: np.asarray(matrix,
+                                                       dtype=np.float32)})
+
+
 def only_pretrained(word_ids,
                     vocab_size,
                     embed_dim,
@@ -52,7 +94,7 @@ def only_pretrained(word_ids,
     if kwargs['is_training']:
         tf.logging.info('Loading pretrained embeddings from %s' %
                         pretrained_path)
-        pretrained_matrix = load_pretrained_matrix(pretrained_path)
+        pretrained_matrix = get_pretrained_matrix(pretrained_path)
         assert pretrained_matrix.shape[
                    0] == vocab_size, "Given vocab size (%d) not equal to than that " \
                                      "of the pre-trained embedding (%d)!" % (
@@ -70,11 +112,9 @@ def only_pretrained(word_ids,
             pretrained_path)
 
         # initialize word_embedding layer from pre-trained matrix
-        word_embedding = tf.get_variable(
+        word_embedding = get_pretrained_variable(
             name='embedding_pretrained',
-            initializer=tf.constant_initializer(np.float32(pretrained_matrix)),
-            dtype=tf.float32,
-            shape=[pretrained_matrix.shape[0], embed_dim],
+            matrix=pretrained_matrix,
             trainable=trainable)
     else:
         # not initializing again but only define placeholders with same names
@@ -117,31 +157,32 @@ def expand_pretrained(word_ids,
     """
     # pretrained file name - .txt
     # word_embedding_name = os.path.basename(pretrained_path)[:-4]
-    tf.logging.info('Loading pretrained embeddings from %s' %
-                    pretrained_path)
-    pretrained_matrix = load_pretrained_matrix(pretrained_path)
-    assert pretrained_matrix.shape[
+    # only the shape is needed when not training, the values are restored
+    # from the checkpoint
+    pretrained_shape = get_pretrained_shape(pretrained_path)
+    assert pretrained_shape[
                0] <= vocab_size, "Given vocab size (%d) is less than that of " \
                                  "the " \
                                  "pre-trained embedding (%d)!" % (
-                                     vocab_size, pretrained_matrix.shape[0])
-    assert pretrained_matrix.shape[
+                                     vocab_size, pretrained_shape[0])
+    assert pretrained_shape[
                1] == embed_dim, "Given embed dim (%d) and that of the " \
                                 "pre-trained embedding (%d) don't match!" % (
-                                    embed_dim, pretrained_matrix.shape[1])
+                                    embed_dim, pretrained_shape[1])
 
     if kwargs['is_training']:
+        tf.logging.info('Loading pretrained embeddings from %s' %
+                        pretrained_path)
+        pretrained_matrix = get_pretrained_matrix(pretrained_path)
 
         tf.logging.info(
             'Generating embedding lookup layer from %s and the words '
             'from the training set' %
             pretrained_path)
 
-        loaded_embedding = tf.get_variable(
+        loaded_embedding = get_pretrained_variable(
             name='embedding_pretrained',
-            initializer=tf.constant_initializer(np.float32(pretrained_matrix)),
-            dtype=tf.float32,
-            shape=[pretrained_matrix.shape[0], embed_dim],
+            matrix=pretrained_matrix,
             trainable=trainable)
 
         # randomly initialize word embeddings for words that appear in the
@@ -165,13 +206,13 @@ def expand_pretrained(word_ids,
 
         loaded_embedding = tf.get_variable(
             name='embedding_pretrained',
-            initializer=tf.zeros(shape=[pretrained_matrix.shape[0], embed_dim],
+            initializer=tf.zeros(shape=[pretrained_shape[0], embed_dim],
                                  dtype=tf.float32),
             dtype=tf.float32,
             trainable=trainable
         )
 
-        extra_vocab_num = vocab_size - pretrained_matrix.shape[0]
+        extra_vocab_num = vocab_size - pretrained_shape[0]
         random_embedding = tf.get_variable(
             name='embedding_training',
             initializer=tf.zeros(shape=[extra_vocab_num, embed_dim],
@@ -246,34 +287,42 @@ def init_pretrained(word_ids,
             trainable=True
         )
 
-    # load training vocab
-    with codecs.open(reverse_vocab_path) as file:
-        reverse_vocab = json.load(file)
+    if kwargs['is_training']:
+        # load training vocab
+        with codecs.open(reverse_vocab_path) as file:
+            reverse_vocab = json.load(file)
 
-    tf.logging.info('Loading pretrained embeddings from %s' % pretrained_path)
-    pretrained_vocab = load_pretrianed_vocab_dict(pretrained_path)
-    pretrained_matrix = load_pretrained_matrix(pretrained_path)
+        tf.logging.info('Loading pretrained embeddings from %s' %
+                        pretrained_path)
+        # only the rows of the training words in pretrained(ids random_size
+        # and above) are loaded
+        loaded_matrix = get_pretrained_rows(
+            pretrained_path,
+            [reverse_vocab[str(i)]
+             for i in range(random_size, len(reverse_vocab))])
+
+        assert loaded_matrix.shape[1] == embed_dim, \
+            "Given embed dim (%d) and that of the pre-trained embedding " \
+            "(%d) don't match!" % (embed_dim, loaded_matrix.shape[1])
+        assert loaded_matrix.shape[0] == vocab_size - random_size
 
-    assert pretrained_matrix.shape[
-               1] == embed_dim, "Given embed dim (%d) and that of the " \
-                                "pre-trained embedding (%d) don't match!" % (
-                                    embed_dim, pretrained_matrix.shape[1])
+        # pretrained file name - .txt
+        # word_embedding_name = os.path.basename(pretrained_path)[:-4]
+        loaded_embedding = get_pretrained_variable(
+            name='embedding_pretrained',
+            matrix=loaded_matrix,
+            trainable=trainable)
 
-    # pretrained file name - .txt
-    # word_embedding_name = os.path.basename(pretrained_path)[:-4]
-    loaded_matrix = np.zeros([vocab_size - random_size, embed_dim])
-
-    for i in tqdm(range(random_size, len(reverse_vocab))):
-        v = reverse_vocab[str(i)]
-        loaded_matrix[i - random_size] = pretrained_matrix[
-            pretrained_vocab.get(v)]
-
-    loaded_embedding = tf.get_variable(
-        name='embedding_pretrained',
-        initializer=tf.constant_initializer(np.float32(loaded_matrix)),
-        dtype=tf.float32,
-        shape=[vocab_size - random_size, embed_dim],
-        trainable=trainable)
+    else:
+        # not loading the file but only define placeholders with same names,
+        # the values are restored from the checkpoint
+        loaded_embedding = tf.get_variable(
+            name='embedding_pretrained',
+            initializer=tf.zeros(shape=[vocab_size - random_size, embed_dim],
+                                 dtype=tf.float32),
+            dtype=tf.float32,
+            trainable=trainable
+        )
 
     tf.logging.info('Generating embedding lookup layer from %s and the words '
                     'from the training set' %
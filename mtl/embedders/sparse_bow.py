@@ -0,0 +1,40 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+
+def sparse_bow_embedding(x, vocab_size, embed_dim, **kwargs):
+    """Project a sparse bag of words into a dense vector
+
+    The same as a dense layer without bias on the dense bag of words, but
+    only the rows of the non-zero entries are read.
+
+    :param x: SparseTensor of shape [batch_size, vocab_size]
+    :param vocab_size: size of vocabulary
+    :param embed_dim: dimension of the output
+    :return: Tensor of shape [batch_size, embed_dim]
+    """
+
+    init = tf.contrib.layers.xavier_initializer(uniform=True)
+    weights = tf.get_variable('embeddings',
+                              shape=[vocab_size, embed_dim],
+                              initializer=init)
+
+    return tf.sparse_tensor_dense_matmul(x, weights)
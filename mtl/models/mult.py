@@ -20,6 +20,7 @@ from __future__ import print_function
 import json
 import os
 
+import numpy as np
 import tensorflow as tf
 
 from mtl.layers.mlp import dense_layer, mlp
@@ -94,6 +95,11 @@ class Mult(object):
 
         return text_field_names
 
+    def get_vocab_size(self):
+        # all the datasets share one vocabulary
+        with open(os.path.join(self._hps.dataset_paths[0], 'args.json')) as f:
+            return int(json.load(f)['vocab_size'])
+
     # TODO remove
     def get_weights(self, batch, text_field_names):
         if self._hps.input_key != 'weights':
@@ -116,7 +122,16 @@ class Mult(object):
             elif self._hps.input_key == 'bow':
                 x.append(batch[text_field_name + '_bow'])
             elif self._hps.input_key == 'tfidf':
-                x.append(batch[text_field_name + '_tfidf'])
+                x.append(sparse_type_features(
+                    batch[text_field_name + '_types'],
+                    batch[text_field_name + '_type_counts'],
+                    batch[text_field_name + '_tfidf'],
+                    self.get_vocab_size()))
+            elif self._hps.input_key == 'sparse_bow':
+                x.append(sparse_bag_of_words(
+                    batch[text_field_name + '_types'],
+                    batch[text_field_name + '_type_counts'],
+                    self.get_vocab_size()))
             # elif self._hps.input_key == 'unique':
             #   x.append(batch[text_field_name + '_unique'])
 
@@ -322,6 +337,51 @@ class Mult(object):
             return total_loss
 
 
+def sparse_bag_of_words(types, type_counts, vocab_size):
+    """Builds the bag of words of a batch from its types as a SparseTensor
+
+    The values are the same as the dense `_bow` feature(binary, divided by
+    the l2 norm).
+
+    :param types: word types of each example, [batch_size, max_num_types],
+        padded with 0
+    :param type_counts: count of each type, [batch_size, max_num_types],
+        padded with 0
+    :param vocab_size: size of vocabulary
+    :return: SparseTensor of shape [batch_size, vocab_size]
+    """
+    num_types = tf.reduce_sum(tf.cast(tf.greater(type_counts, 0), tf.float32),
+                              axis=1, keepdims=True)
+    values = 1.0 / (tf.sqrt(num_types) + np.finfo(np.float32).eps)
+    values = values * tf.ones_like(types, dtype=tf.float32)
+    return sparse_type_features(types, type_counts, values, vocab_size)
+
+
+def sparse_type_features(types, type_counts, values, vocab_size):
+    """Scatters per-type values of a batch into a SparseTensor
+
+    :param types: word types of each example, [batch_size, max_num_types],
+        padded with 0
+    :param type_counts: count of each type, [batch_size, max_num_types],
+        padded with 0
+    :param values: value of each type, e.g. its tf-idf, same shape as types
+    :param vocab_size: size of vocabulary
+    :return: SparseTensor of shape [batch_size, vocab_size] with values[i, j]
+        at [i, types[i, j]]
+    """
+    # padded positions are the ones with zero counts
+    positions = tf.where(tf.greater(type_counts, 0))
+    ids = tf.gather_nd(types, positions)
+
+    features = tf.SparseTensor(
+        indices=tf.stack([positions[:, 0], tf.cast(ids, tf.int64)], axis=1),
+        values=tf.gather_nd(values, positions),
+        dense_shape=tf.stack([tf.shape(types, out_type=tf.int64)[0],
+                              tf.constant(vocab_size, dtype=tf.int64)]))
+    # types are not sorted in TFRecord files written by older versions
+    return tf.sparse_reorder(features)
+
+
 def build_mlps(hps, is_shared):
     mlps = dict()
     if is_shared:
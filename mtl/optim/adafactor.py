@@ -20,6 +20,7 @@ from __future__ import division
 from __future__ import print_function
 
 import tensorflow as tf
+from six.moves import xrange
 
 
 # Dependency imports
@@ -109,6 +110,7 @@ class AdafactorOptimizer(tf.train.Optimizer):
                  clipping_threshold=1.0,
                  factored=True,
                  simulated_quantize_bits=None,
+                 slot_dtype=tf.float32,
                  use_locking=False,
                  name="Adafactor"):
         """Construct a new Adafactor optimizer.
@@ -125,6 +127,9 @@ class AdafactorOptimizer(tf.train.Optimizer):
             for 2d variables
           simulated_quantize_bits: train with simulated quantized parameters
             (experimental)
+          slot_dtype: dtype the slots are stored in, e.g. tf.bfloat16 or
+            tf.float16 to halve their memory; the updates are still computed
+            in float32
           use_locking: If True use locks for update operations.
           name: Optional name for the operations created when applying gradients.
             Defaults to "AdafactorOptimizer".
@@ -146,6 +151,7 @@ class AdafactorOptimizer(tf.train.Optimizer):
         self._clipping_threshold = clipping_threshold
         self._factored = factored
         self._simulated_quantize_bits = simulated_quantize_bits
+        self._slot_dtype = tf.as_dtype(slot_dtype)
         if self._simulated_quantize_bits:
             self._quantization_noise = _quantization_noise_from_step_num()
 
@@ -165,21 +171,103 @@ class AdafactorOptimizer(tf.train.Optimizer):
         for var in var_list:
             shape = var.get_shape().as_list()
             if self._beta1:
-                self._zeros_slot(var, "m", self._name)
+                m_val = tf.zeros(shape, dtype=self._slot_dtype)
+                self._get_or_make_slot(var, m_val, "m", self._name)
             if self._should_use_factored_second_moment_estimate(shape):
-                r_val = tf.zeros([shape[0]], dtype=tf.float32)
-                c_val = tf.zeros([shape[1]], dtype=tf.float32)
+                r_val = tf.zeros([shape[0]], dtype=self._slot_dtype)
+                c_val = tf.zeros([shape[1]], dtype=self._slot_dtype)
                 self._get_or_make_slot(var, r_val, "vr", self._name)
                 self._get_or_make_slot(var, c_val, "vc", self._name)
             else:
-                v_val = tf.zeros(shape, dtype=tf.float32)
+                v_val = tf.zeros(shape, dtype=self._slot_dtype)
                 self._get_or_make_slot(var, v_val, "v", self._name)
 
     def _apply_dense(self, grad, var):
         return self._resource_apply_dense(grad, var)
 
     def _apply_sparse(self, grad, var):
-        return self._apply_dense(tf.convert_to_tensor(grad), var)
+        """Lazy row-wise update for sparse(e.g. embedding) gradients.
+
+        Only the rows of var in grad.indices and their rows of the slots
+        are read and written, instead of densifying grad to the full shape
+        of var. As in LazyAdam, the moments of the other rows are not
+        decayed. The parameter scale is estimated from the updated rows, and
+        for a factored estimator the column moments are updated with the mean
+        over the updated rows. grad.indices are unique(apply_gradients sums
+        the duplicates).
+        """
+        indices = grad.indices
+        grad = tf.to_float(grad.values)
+        grad_squared = tf.square(grad) + 1e-30
+        grad_squared_mean = tf.reduce_mean(grad_squared)
+        decay_rate = self._decay_rate
+        update_scale = self._learning_rate
+        var_rows = tf.gather(var, indices)
+        if self._multiply_by_parameter_scale:
+            update_scale *= tf.to_float(self._parameter_scale(var_rows))
+        # HACK: see _resource_apply_dense()
+        decay_rate += grad_squared_mean * 1e-30
+        update_scale += grad_squared_mean * 1e-30
+        # END HACK
+        mixing_rate = 1.0 - decay_rate
+        shape = var.get_shape().as_list()
+        updates = []
+        if self._should_use_factored_second_moment_estimate(shape):
+            grad_squared_row_mean = tf.reduce_mean(grad_squared, 1)
+            grad_squared_col_mean = tf.reduce_mean(grad_squared, 0)
+            vr = self.get_slot(var, "vr")
+            vr_rows = tf.to_float(tf.gather(vr, indices))
+            new_vr_rows = decay_rate * vr_rows + \
+                mixing_rate * grad_squared_row_mean
+            vc = self.get_slot(var, "vc")
+            new_vc = decay_rate * tf.to_float(vc) + \
+                mixing_rate * grad_squared_col_mean
+            vr_update = tf.scatter_update(vr, indices,
+                                          tf.cast(new_vr_rows, vr.dtype),
+                                          use_locking=self._use_locking)
+            vc_update = tf.assign(vc, tf.cast(new_vc, vc.dtype),
+                                  use_locking=self._use_locking)
+            updates = [vr_update, vc_update]
+            # vr is [num_rows], cheap to average in full
+            long_term_mean = tf.reduce_mean(tf.to_float(vr_update))
+            r_factor = tf.rsqrt(new_vr_rows / long_term_mean)
+            c_factor = tf.rsqrt(new_vc)
+            x = grad * tf.expand_dims(r_factor, 1) * \
+                tf.expand_dims(c_factor, 0)
+        else:
+            v = self.get_slot(var, "v")
+            v_rows = tf.to_float(tf.gather(v, indices))
+            new_v_rows = decay_rate * v_rows + mixing_rate * grad_squared
+            v_update = tf.scatter_update(v, indices,
+                                         tf.cast(new_v_rows, v.dtype),
+                                         use_locking=self._use_locking)
+            updates = [v_update]
+            x = grad * tf.rsqrt(new_v_rows)
+        if self._clipping_threshold is not None:
+            clipping_denom = tf.maximum(1.0, reduce_rms(
+                x) / self._clipping_threshold)
+            x /= clipping_denom
+        subtrahend = update_scale * x
+        if self._beta1:
+            m = self.get_slot(var, "m")
+            m_rows = tf.to_float(tf.gather(m, indices))
+            new_m_rows = self._beta1 * m_rows + \
+                (1.0 - self._beta1) * subtrahend
+            subtrahend = new_m_rows
+            new_m_rows = tf.cast(new_m_rows, m.dtype)
+            updates.append(tf.scatter_update(m, indices, new_m_rows,
+                                             use_locking=self._use_locking))
+        new_rows = tf.to_float(var_rows) - subtrahend
+        if var.dtype == tf.bfloat16:
+            new_rows = _to_bfloat16_unbiased(new_rows)
+        if self._simulated_quantize_bits:
+            new_rows = _simulated_quantize(
+                new_rows, self._simulated_quantize_bits,
+                self._quantization_noise)
+        var_update = tf.scatter_update(var, indices, new_rows,
+                                       use_locking=self._use_locking)
+        updates = [var_update] + updates
+        return tf.group(*updates)
 
     def _parameter_scale(self, var):
         """Estimate the scale of the parameters from the current values.
@@ -219,11 +307,15 @@ class AdafactorOptimizer(tf.train.Optimizer):
             grad_squared_row_mean = tf.reduce_mean(grad_squared, 1)
             grad_squared_col_mean = tf.reduce_mean(grad_squared, 0)
             vr = self.get_slot(var, "vr")
-            new_vr = (decay_rate * vr + mixing_rate * grad_squared_row_mean)
+            new_vr = decay_rate * tf.to_float(vr) + \
+                mixing_rate * grad_squared_row_mean
             vc = self.get_slot(var, "vc")
-            new_vc = (decay_rate * vc + mixing_rate * grad_squared_col_mean)
-            vr_update = tf.assign(vr, new_vr, use_locking=self._use_locking)
-            vc_update = tf.assign(vc, new_vc, use_locking=self._use_locking)
+            new_vc = decay_rate * tf.to_float(vc) + \
+                mixing_rate * grad_squared_col_mean
+            vr_update = tf.assign(vr, tf.cast(new_vr, vr.dtype),
+                                  use_locking=self._use_locking)
+            vc_update = tf.assign(vc, tf.cast(new_vc, vc.dtype),
+                                  use_locking=self._use_locking)
             updates = [vr_update, vc_update]
             long_term_mean = tf.reduce_mean(new_vr)
             r_factor = tf.rsqrt(new_vr / long_term_mean)
@@ -231,8 +323,9 @@ class AdafactorOptimizer(tf.train.Optimizer):
             x = grad * tf.expand_dims(r_factor, 1) * tf.expand_dims(c_factor, 0)
         else:
             v = self.get_slot(var, "v")
-            new_v = decay_rate * v + mixing_rate * grad_squared
-            v_update = tf.assign(v, new_v, use_locking=self._use_locking)
+            new_v = decay_rate * tf.to_float(v) + mixing_rate * grad_squared
+            v_update = tf.assign(v, tf.cast(new_v, v.dtype),
+                                 use_locking=self._use_locking)
             updates = [v_update]
             x = grad * tf.rsqrt(new_v)
         if self._clipping_threshold is not None:
@@ -245,7 +338,7 @@ class AdafactorOptimizer(tf.train.Optimizer):
             new_m = self._beta1 * tf.to_float(m) + (
                     1.0 - self._beta1) * subtrahend
             subtrahend = new_m
-            new_m = tf.cast(new_m, var.dtype)
+            new_m = tf.cast(new_m, m.dtype)
             updates.append(tf.assign(m, new_m, use_locking=self._use_locking))
         new_val = tf.to_float(var) - subtrahend
         if var.dtype == tf.bfloat16:
@@ -21,6 +21,7 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import heapq
 
 import six
 
@@ -125,33 +126,40 @@ class CategoricalVocabulary(object):
             Useful to remove very frequent categories (like stop words).
 
         """
-        # Sort by alphabet then reversed frequency.
+        # Sort by reversed frequency then alphabet, in a single sort(or only
+        # the top max_vocab_size - 1 words with a heap).
         if not max_vocab_size:
             max_vocab_size = float('inf')
-        self._freq = sorted(
-            sorted(
-                six.iteritems(self._freq),
-                key=lambda x: (isinstance(x[0], str), x[0])),
-            key=lambda x: x[1],
-            reverse=True)
+
+        def sort_key(x):
+            return -x[1], isinstance(x[0], str), x[0]
+
+        kept = [(category, count) for category, count in
+                six.iteritems(self._freq)
+                if count > min_frequency and not 0 < max_frequency <= count]
+        # the unknown token counts toward max_vocab_size, which is ignored
+        # if it can't be reached
+        if max_vocab_size != float('inf') and max_vocab_size >= 2 and \
+                max_vocab_size == int(max_vocab_size):
+            kept = heapq.nsmallest(int(max_vocab_size) - 1, kept, key=sort_key)
+        else:
+            kept.sort(key=sort_key)
+
         self._mapping = {self._unknown_token: 0}
         if self._support_reverse:
             self._reverse_mapping = [self._unknown_token]
-        idx = 1
-        vocab_size = 1
-        for category, count in self._freq:
-            if 0 < max_frequency <= count:
-                continue
-            if count <= min_frequency:
-                break
+        for idx, (category, count) in enumerate(kept, 1):
             self._mapping[category] = idx
-            idx += 1
             if self._support_reverse:
                 self._reverse_mapping.append(category)
-            vocab_size += 1
-            if vocab_size == max_vocab_size:
-                break
-        self._freq = dict(self._freq[:idx - 1])
+
+        if 0 < max_frequency:
+            # the frequencies of the most frequent len(kept) words are kept,
+            # including the ones above max_frequency
+            self._freq = dict(heapq.nsmallest(
+                len(kept), six.iteritems(self._freq), key=sort_key))
+        else:
+            self._freq = dict(kept)
 
     def reverse(self, class_id):
         """Given class id reverse to original class name.
@@ -171,6 +179,10 @@ class CategoricalVocabulary(object):
                              "support_reverse to support reverse() function.")
         return self._reverse_mapping[class_id]
 
+    @property
+    def frozen(self):
+        return self._freeze
+
     @property
     def freq(self):
         return self._freq
@@ -64,6 +64,17 @@ VOCAB_NAMES = [
     'crawl-300d-2M.vec.zip',
 ]
 
+"""Pre-trained word embeddings converted to a float32 .npy matrix plus a
+vocabulary file with one word per line by
+expts/scripts/convert_embeddings.py, e.g. glove.6B.50d.txt ->
+glove.6B.50d.npy and glove.6B.50d.vocab"""
+PRETRAINED_EXTS = ['.txt', '.bin.gz', '.zip']
+EMBEDDING_STORE_EXT = '.npy'
+EMBEDDING_VOCAB_EXT = '.vocab'
+VOCAB_NAMES += [name[:-len(ext)] + EMBEDDING_STORE_EXT
+                for name in VOCAB_NAMES[2:]
+                for ext in PRETRAINED_EXTS if name.endswith(ext)]
+
 """Experiment names"""
 
 
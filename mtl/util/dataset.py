@@ -22,11 +22,14 @@ from __future__ import print_function
 import codecs
 import functools
 import gzip
+import hashlib
 import itertools
+import collections
 import json
-import operator
+import multiprocessing
 import os
 import sys
+import tempfile
 from pathlib import Path
 
 import numpy as np
@@ -35,26 +38,43 @@ from six.moves import xrange
 from tqdm import tqdm
 
 from mtl.util.categorical_vocabulary import CategoricalVocabulary
-from mtl.util.constants import OLD_LINEBREAKS, LINEBREAK, EOS, BOS, OOV
+from mtl.util.constants import LINEBREAK, EOS, BOS, OOV
 from mtl.util.constants import RANDOM_SEED
 from mtl.util.constants import TRAIN_RATIO, VALID_RATIO
 from mtl.util.constants import VOCAB_NAMES
 from mtl.util.data_prep import (tweet_tokenizer,
                                 tweet_tokenizer_keep_handles,
                                 ruder_tokenizer,
-                                split_tokenizer, lower_tokenizer, preproc,
-                                remove_stopwords, porter_stemmer,
-                                snowball_stemmer, wordnet_stemmer)
+                                split_tokenizer, lower_tokenizer, fast_preproc,
+                                get_stem_fn, stem_and_remove_stopwords,
+                                stem_cache_info)
 from mtl.util.load_embeds import combine_vocab, reorder_vocab, \
     load_pretrianed_vocab_dict
 from mtl.util.text import VocabularyProcessor, tokenizer_simple
-from mtl.util.util import bag_of_words, tfidf, make_dir
+from mtl.util.util import inverse_document_frequencies, sparse_tfidf, \
+    make_dir
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 flags = tf.flags
 logging = tf.logging
 
 FLAGS = flags.FLAGS
 
+# number of examples sent to a worker at a time when streaming the data
+STREAM_CHUNK_SIZE = 1000
+
+# bump when the tokenized text changes for the same data file and arguments,
+# e.g. after changing the tokenizing or preprocessing code, so that the old
+# token caches are not reused
+TOKEN_CACHE_VERSION = 1
+
+# e.g. train-00000-of-00004.tf
+SHARD_NAME_FORMAT = '{}-{:05d}-of-{:05d}{}'
+
 
 class Dataset:
     def __init__(self,
@@ -118,6 +138,18 @@ class Dataset:
         :param preproc: whether to remove urls, trailing/leading whitespaces and
             replace linebreaks
         :param vocab_all: whether to use all three splits when building vocabulary
+        :param num_workers: number of processes used to tokenize the text, 1
+            to tokenize in the current process
+        :param token_cache: whether to save the tokenized text to
+            token_cache_dir and reuse it when the data file and the
+            preprocessing arguments are the same
+        :param token_cache_dir: directory of the tokenized text caches,
+            tfrecord_dir(or the temporary directory if there's none) if None
+        :param stream_data: whether to read the examples from the data file one
+            at a time instead of loading the whole file, extracting the labels
+            and the tokens in a single pass without keeping the examples
+        :param num_shards: number of files each split is written to, the
+            shards are written by num_workers processes
         """
 
         self._json_dir = json_dir
@@ -147,7 +179,12 @@ class Dataset:
             'train_ratio': TRAIN_RATIO,
             'valid_ratio': VALID_RATIO,
             'random_seed': RANDOM_SEED,
-            'subsample_ratio': 1
+            'subsample_ratio': 1,
+            'num_workers': 1,
+            'token_cache': False,
+            'token_cache_dir': None,
+            'stream_data': False,
+            'num_shards': 1
         }
         for k, v in kwargs.items():
             # print(k)
@@ -189,7 +226,8 @@ class Dataset:
         self._label_list = None
         self._label_set = None
         self._num_classes = None
-        self.get_label()
+        if not self._args['stream_data']:
+            self.get_label()
 
         self._num_examples = 0
         self._sequences = dict()
@@ -198,6 +236,10 @@ class Dataset:
         self._weights = dict()
         self.get_text()
 
+        if self._args['stream_data']:
+            # labels are collected while streaming the text
+            self.set_label_info()
+
         self.get_index()
         self.get_max_doc_len()  # TODO remove?
 
@@ -244,12 +286,10 @@ class Dataset:
         self._args['vocab_size'] = len(self._categorical_vocab.mapping)
         print("used vocab size =", self._args['vocab_size'])
 
-        # generate tfidf list if write_tfidf is True
+        # get the idf values if write_tfidf is True
+        self._idf = None
         if self._args['write_tfidf']:
-            # TODO: determine if tfidf should be calculated based on each
-            # sequence kind or on all sequences regardless of kind
-            raise NotImplementedError(
-                "tfidf (%s) not currently supported" % tfidf)
+            self.get_idf()
 
         self.write_tfrecord()
 
@@ -266,9 +306,10 @@ class Dataset:
                 print(
                     'Maximum document length not given, computing from training '
                     'data..')
-                for text_field_name in tqdm(self._args['text_field_names']):
-                    tmp_max = max(len(self._sequences[text_field_name][i])
-                                  for i in self._train_index)
+                tmp_max = max(
+                    int(np.max(self._sequence_lengths[text_field_name][
+                        self._train_index]))
+                    for text_field_name in self._args['text_field_names'])
                 self._args['max_document_length'] = max(tmp_max,
                                                         self._args[
                                                             'max_document_length'])
@@ -303,10 +344,17 @@ class Dataset:
         if self._args['predict_mode']:
             self._args['predict_path'] = self._predict_tf_path
             print("Writing TFRecord file for the predicting file...")
-            self.write_examples(self._args['predict_path'], self._predict_index,
-                                labeled=False)
+            # never sharded, the driver reads the file given by the user
+            write_examples_file(self._args['predict_path'],
+                                self.get_split_data(self._predict_index),
+                                labeled=False,
+                                config=self.get_example_config())
             return
 
+        def shard_names(file_names):
+            # recorded relative to the TFRecord directory
+            return [os.path.basename(file_name) for file_name in file_names]
+
         # write TFRecords for train/valid/test data
 
         # write labeled data to TFRecord files
@@ -316,20 +364,21 @@ class Dataset:
         self._args['test_path'] = os.path.join(self._tfrecord_dir, 'test.tf')
 
         print("Writing TFRecord file for the training data...")
-        self.write_examples(
-            self._args['train_path'], self._train_index, labeled=True)
+        self._args['train_shards'] = shard_names(self.write_examples(
+            self._args['train_path'], self._train_index, labeled=True))
         print("Writing TFRecord file for the validation data...")
-        self.write_examples(
-            self._args['valid_path'], self._valid_index, labeled=True)
+        self._args['valid_shards'] = shard_names(self.write_examples(
+            self._args['valid_path'], self._valid_index, labeled=True))
         print("Writing TFRecord file for the test data...")
-        self.write_examples(
-            self._args['test_path'], self._test_index, labeled=True)
+        self._args['test_shards'] = shard_names(self.write_examples(
+            self._args['test_path'], self._test_index, labeled=True))
 
         # write unlabeled data to TFRecord files if there're any
 
         if len(self._unlabeled_index) == 0:
             print("Unlabeled data not found.")
             self._args['unlabeled_path'] = None
+            self._args['unlabeled_shards'] = []
             self._args['has_unlabeled'] = False
         else:
             print("Unlabeled data found.")
@@ -337,12 +386,16 @@ class Dataset:
             print("Writing TFRecord files for the unlabeled data...")
             self._args['unlabeled_path'] = os.path.join(self._tfrecord_dir,
                                                         'unlabeled.tf')
-            self.write_examples(
+            self._args['unlabeled_shards'] = shard_names(self.write_examples(
                 self._args['unlabeled_path'], self._unlabeled_index,
-                labeled=False)
+                labeled=False))
 
     def get_label(self):
         print('Generating label list...')
+        self._label_list = [self.parse_label(item) for item in tqdm(self._data)]
+        self.set_label_info()
+
+    def parse_label(self, item):
         if self._args['label_type'] == 'int':
             transfer = int
         elif self._args['label_type'] == 'float':
@@ -350,10 +403,11 @@ class Dataset:
         else:
             raise TypeError('Label type other than "int" and "float" is not '
                             'implemetned!')
-        self._label_list = [transfer(item[self._args['label_field_name']])
-                            if self._args['label_field_name'] in item else None
-                            for
-                            item in tqdm(self._data)]
+        if self._args['label_field_name'] in item:
+            return transfer(item[self._args['label_field_name']])
+        return None
+
+    def set_label_info(self):
         # TODO: is it possible that the label list read doesn't cover all the
         # labels?
         self._label_set = set(self._label_list)
@@ -361,9 +415,28 @@ class Dataset:
         self._num_classes = len(set(self._label_list))
 
     def read_data(self):
+        if self._args['stream_data']:
+            # examples are read one at a time in get_text()
+            print('Streaming data from', self._data_file_name)
+            return
         print('Loading data from', self._data_file_name)
-        with gzip.open(self._data_file_name, mode='rt') as file:
-            self._data = json.load(file, encoding='utf-8')
+        self._data = list(read_json_examples(self._data_file_name))
+
+    def iter_data(self):
+        """Yields the examples, collecting the ids(and the labels when
+        streaming) on the way"""
+        streaming = self._data is None
+        if streaming:
+            examples = read_json_examples(self._data_file_name)
+            self._label_list = []
+        else:
+            examples = self._data
+        for item in examples:
+            if streaming:
+                self._label_list.append(self.parse_label(item))
+            if self._args['predict_mode'] and 'id' in item:
+                self._ids.append(item['id'])
+            yield item
 
     def get_text(self):
         # tokenize and reconstruct as string(which vocabulary processor
@@ -385,59 +458,32 @@ class Dataset:
         #   self._sequences[text_field_name][index_of_interest]
         # for each text_field_name because the sequences for an example are
         # indexed by the same number.
+        if self._args['token_cache']:
+            cache_path = self.get_token_cache_path()
+            if os.path.exists(cache_path):
+                self.load_token_cache(cache_path)
+                # still one pass over the data for the ids and labels
+                for _ in self.iter_data():
+                    pass
+                return
+
         for text_field_name in self._args['text_field_names']:
             self._sequences[text_field_name] = list()
             self._sequence_lengths[text_field_name] = list()
 
         print("Generating text lists...")
         min_seq_len = sys.maxsize
-        for index, item in tqdm(enumerate(self._data)):
+        for index, (texts, weights) in tqdm(
+                enumerate(self.tokenize_data(self.iter_data()))):
             self._num_examples += 1
 
-            if self._args['predict_mode']:
-                if 'id' in item:
-                    self._ids.append(item['id'])
-
-            for text_field_name in self._args['text_field_names']:
-                text = item[text_field_name]
-
-                if self._args['preproc']:
-
-                    # remove leading and trailing whitespaces(to get rid of redundant
-                    # linebreaks)
-                    text = text.strip()
-                    text = preproc(text)
-
-                    # replace line breaks
-                    for old_linebreak in OLD_LINEBREAKS:
-                        text = text.replace(old_linebreak, LINEBREAK)
-
-                text = self._tokenizer(text)
-                if self._stemmer:
-                    text = self._stemmer(text)
-
-                text = [BOS] + text + [EOS]
-
-                if 'weight' in item:
+            for text_field_name, text, weight in zip(
+                    self._args['text_field_names'], texts, weights):
 
+                if weight is not None:
                     if text_field_name not in self._weights:
                         self._weights[text_field_name] = []
-                    weights = [float(weight) for weight in
-                               item['weight'].split()]
-                    # TODO un-hardcode
-                    # add 1.0 for BOS and EOS
-                    weights = [1.0] + weights + [1.0]
-                    self._weights[text_field_name].append(weights)
-
-                if self._args['stopwords']:
-                    if 'weight' in item:
-                        text, self._weights[text_field_name][index] = \
-                            remove_stopwords(text, stopwords='nltk',
-                                             weights=
-                                             self._weights[text_field_name][
-                                                 index])
-                    else:
-                        text = remove_stopwords(text, stopwords='nltk')
+                    self._weights[text_field_name].append(weight)
 
                 if len(text) < 3:
                     print(" Empty text in", self._json_dir, 'index', index)
@@ -453,6 +499,13 @@ class Dataset:
                 self._sequence_lengths[text_field_name].append(len(text))
 
         print('Minimum sequence length: %d' % min_seq_len)
+        if self._args['stemmer']:
+            # only the stemming done in this process is counted
+            info = stem_cache_info()[self._args['stemmer']]
+            if info['hits'] + info['misses'] > 0:
+                print('Stem cache: {} hits, {} misses, hit rate {:.2%}, {} '
+                      'tokens cached'.format(info['hits'], info['misses'],
+                                             info['hit_rate'], info['size']))
 
         for text_field_name in self._args['text_field_names']:
             # Check that every example has every field
@@ -461,34 +514,128 @@ class Dataset:
                     len(self._sequences[text_field_name]))
             assert len(
                 self._sequence_lengths[text_field_name]) == self._num_examples
+            self._sequence_lengths[text_field_name] = np.asarray(
+                self._sequence_lengths[text_field_name], dtype=np.int64)
+
+        if self._args['token_cache']:
+            self.save_token_cache(cache_path)
+
+    def get_token_cache_path(self):
+        """Path of the tokenized text cache of the data file
+
+        The file name is a hash of the data file's content, all the
+        arguments that change the tokenized text and TOKEN_CACHE_VERSION, so
+        changing vocabulary or split arguments still hits the cache.
+        """
+        key = get_token_cache_key(self._data_file_name,
+                                  self._args['text_field_names'],
+                                  self._args['tokenizer_'],
+                                  self._args['stemmer'],
+                                  self._args['stopwords'],
+                                  self._args['preproc'])
+        cache_dir = self._args['token_cache_dir'] or self._tfrecord_dir or \
+            tempfile.gettempdir()
+        return os.path.join(cache_dir, 'tokenized_' + key + '.pkl')
+
+    def load_token_cache(self, cache_path):
+        print('Loading tokenized text from', cache_path)
+        with open(cache_path, 'rb') as file:
+            cache = pickle.load(file)
+        self._num_examples = cache['num_examples']
+        self._sequences = cache['sequences']
+        self._sequence_lengths = {
+            k: np.asarray(v, dtype=np.int64)
+            for k, v in cache['sequence_lengths'].items()}
+        self._weights = cache['weights']
+
+    def save_token_cache(self, cache_path):
+        cache_dir = os.path.dirname(cache_path)
+        try:
+            make_dir(cache_dir)
+        except OSError:
+            pass
+        if not os.access(cache_dir, os.W_OK):
+            logging.warning('Not caching the tokenized text: %s is not '
+                            'writable', cache_dir)
+            return
+        print('Saving tokenized text to', cache_path)
+        cache = {
+            'num_examples': self._num_examples,
+            'sequences': self._sequences,
+            'sequence_lengths': self._sequence_lengths,
+            'weights': self._weights
+        }
+        # write to a temporary file first so that an interrupted run never
+        # leaves a truncated cache behind
+        tmp_path = cache_path + '.tmp.' + str(os.getpid())
+        try:
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(cache, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError) as e:
+            logging.warning('Not caching the tokenized text: %s', e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def tokenize_data(self, examples):
+        """Run the per-document text pipeline over the examples
+
+        Yields (texts, weights) for every example in the original order, where
+        texts/weights are lists aligned with text_field_names. With
+        num_workers > 1 the data is split into chunks that are tokenized in a
+        process pool, which gives exactly the same output as the serial path.
+        """
+        num_workers = self._args['num_workers']
+        if not num_workers or num_workers <= 1:
+            for item in examples:
+                yield tokenize_example(item,
+                                       self._args['text_field_names'],
+                                       self._tokenizer,
+                                       self._stemmer,
+                                       self._args['preproc'],
+                                       self._args['stopwords'])
+            return
+
+        tokenize_fn = functools.partial(
+            tokenize_examples,
+            text_field_names=self._args['text_field_names'],
+            tokenizer_name=self._args['tokenizer_'],
+            stemmer_name=self._args['stemmer'],
+            preproc_text=self._args['preproc'],
+            stopwords=self._args['stopwords'])
+
+        pool = multiprocessing.Pool(processes=num_workers)
+        try:
+            if self._data is not None:
+                chunks = split_chunks(self._data, num_workers * 4)
+                print('Tokenizing {} chunks with {} worker processes...'.format(
+                    len(chunks), num_workers))
+                # imap keeps the order of the chunks
+                for results in pool.imap(tokenize_fn, chunks):
+                    for result in results:
+                        yield result
+                return
+
+            # Pool.imap would pull the whole stream into its task queue, so
+            # only hand out one chunk per worker at a time
+            print('Tokenizing with {} worker processes...'.format(num_workers))
+            chunks = iter_chunks(examples, STREAM_CHUNK_SIZE)
+            while True:
+                window = list(itertools.islice(chunks, num_workers))
+                if not window:
+                    break
+                for results in pool.imap(tokenize_fn, window):
+                    for result in results:
+                        yield result
+        finally:
+            pool.close()
+            pool.join()
 
     def get_tokenizer(self):
-        if self._args['tokenizer_'] == "tweet_tokenizer":
-            self._tokenizer = tweet_tokenizer.tokenize
-        elif self._args['tokenizer_'] == "tweet_tokenizer_keep_handles":
-            self._tokenizer = tweet_tokenizer_keep_handles.tokenize
-        elif self._args['tokenizer_'] == "ruder_tokenizer":
-            self._tokenizer = functools.partial(ruder_tokenizer,
-                                                preserve_case=False)
-        elif self._args['tokenizer_'] == "split_tokenizer":
-            self._tokenizer = functools.partial(split_tokenizer)
-        elif self._args['tokenizer_'] == "lower_tokenizer":
-            self._tokenizer = functools.partial(lower_tokenizer)
-        else:
-            raise ValueError(
-                "unrecognized tokenizer: %s" % self._args['tokenizer_'])
+        self._tokenizer = get_tokenizer_fn(self._args['tokenizer_'])
 
     def get_stemmer(self):
-        if self._args['stemmer'] == 'porter_stemmer':
-            self._stemmer = porter_stemmer
-        elif self._args['stemmer'] == 'snowball_stemmer':
-            self._stemmer = snowball_stemmer
-        elif self._args['stemmer'] == 'wordnet_stemmer':
-            self._stemmer = wordnet_stemmer
-        elif not self._args['stemmer']:
-            self._stemmer = None
-        else:
-            raise ValueError("unrecognized stemmer: %s" % self._args['stemmer'])
+        self._stemmer = get_stemmer_fn(self._args['stemmer'])
 
     def build_vocab(self):
         """Builds vocabulary for this dataset only using tensorflow's
@@ -563,19 +710,14 @@ class Dataset:
 
     def get_training_docs(self):
         # build vocabulary only according to training data
-        training_docs = [self._sequences[text_field_name][i]
-                         for text_field_name in self._args['text_field_names']
-                         for i in self._train_index]
+        # (a generator, the docs are only iterated once when fitting)
+        split_indices = [self._train_index]
         if self._args['vocab_all']:
-            training_docs += [self._sequences[text_field_name][i]
-                              for text_field_name in
-                              self._args['text_field_names']
-                              for i in self._valid_index]
-            training_docs += [self._sequences[text_field_name][i]
-                              for text_field_name in
-                              self._args['text_field_names']
-                              for i in self._test_index]
-        return training_docs
+            split_indices += [self._valid_index, self._test_index]
+        return (self._sequences[text_field_name][i]
+                for split_index in split_indices
+                for text_field_name in self._args['text_field_names']
+                for i in split_index)
 
     def build_save_basic_vocab(self):
         """Build vocabulary with min_frequency=0 for this dataset'
@@ -760,129 +902,111 @@ class Dataset:
         return self._vocab_processor.vocabulary_
 
     def transform_text(self):
-        if self._args['padding']:
-            # TODO: update implementation of transform_pad() to take a max length
-            # as different kinds of sequences within a single example will have
-            # different max lengths
-            for text_field_name in self._args['text_field_names']:
-                self._sequences[text_field_name] = list(
-                    self._vocab_processor.transform_pad(
-                        self._sequences[text_field_name]))
-        else:
-            for text_field_name in self._args['text_field_names']:
-                self._sequences[text_field_name] = list(
-                    self._vocab_processor.transform(
-                        self._sequences[text_field_name]))
-
+        # the word ids of each text field are kept in a FlatSequences(one
+        # int32 buffer plus offsets) instead of a list of lists of ints
         for text_field_name in self._args['text_field_names']:
-            self._sequences[text_field_name] = [list(i)
-                                                for i
-                                                in self._sequences[
-                                                    text_field_name]]
+            # TODO: update implementation of transform_flat() to take a max
+            # length as different kinds of sequences within a single
+            # example will have different max lengths
+            ids, offsets = self._vocab_processor.transform_flat(
+                self._sequences[text_field_name],
+                padding=self._args['padding'])
+            self._sequences[text_field_name] = FlatSequences(ids, offsets)
 
     def write_examples(self, file_name, split_index, labeled):
-        # write to TFRecord data file
-        tf.logging.info("Writing to: %s", file_name)
-        with tf.python_io.TFRecordWriter(file_name) as writer:
-            for index in tqdm(split_index):
-                feature = dict()
-
-                # Gather sequences and sequence statistics
-                feature['index'] = tf.train.Feature(
-                    int64_list=tf.train.Int64List(
-                        value=[index]))
+        """Writes the examples of a split to file_name
 
-                if self._ids:
-                    feature['id'] = tf.train.Feature(
-                        bytes_list=tf.train.BytesList(
-                            value=[str(self._ids[index]).encode('utf-8')]))
+        With num_shards > 1 the split is written to num_shards files named
+        like train-00000-of-00004.tf instead, built and serialized in a
+        process pool of num_workers processes.
 
-                for text_field_name in self._args['text_field_names']:
-                    feature[text_field_name] = tf.train.Feature(
-                        int64_list=tf.train.Int64List(
-                            value=self._sequences[text_field_name][index]))
-                    feature[text_field_name + '_length'] = tf.train.Feature(
-                        int64_list=tf.train.Int64List(
-                            value=[self._sequence_lengths[text_field_name][
-                                       index]]))
-
-                    if self._weights:
-                        feature[
-                            text_field_name + '_weights'] = tf.train.Feature(
-                            float_list=tf.train.FloatList(
-                                value=self._weights[text_field_name][index])
-                        )
-
-                    types, counts = get_types_and_counts(
-                        self._sequences[text_field_name][
-                            index])  # including BOS and EOS
-                    assert len(types) == len(counts)
-                    assert len(types) > 0
-                    for t in types:
-                        assert t >= 0
-                        assert t < self._args['vocab_size']
-                    for c in counts:
-                        assert c > 0
-                        assert c <= len(self._sequences[text_field_name][index])
-
-                    feature[text_field_name + '_types'] = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=types))
-                    feature[
-                        text_field_name + '_type_counts'] = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=counts))
-                    feature[
-                        text_field_name + '_types_length'] = tf.train.Feature(
-                        int64_list=tf.train.Int64List(value=[len(types)]))
-
-                    if self._args['write_bow']:
-                        # This assumes a single vocabulary shared among all sequence kinds
-                        bow = bag_of_words(
-                            self._sequences[text_field_name][index],
-                            self._args['vocab_size']).tolist()
-                        feature[text_field_name + '_bow'] = tf.train.Feature(
-                            float_list=tf.train.FloatList(value=bow))
-
-                    # if self._args['write_unique']:
-                    #   feature[text_field_name + '_unique'] = tf.train.Feature(
-                    #     int64_list=tf.train.Int64List(
-                    #       value=list(OrderedDict.fromkeys(
-                    #         self._sequences[text_field_name][index]))))  # keep order
-
-                # Gather label
-
-                if labeled:
-                    label = self._label_list[index]
-                    assert label is not None
-
-                    if self._args['label_type'] == 'int':
-                        feature['label'] = tf.train.Feature(
-                            int64_list=tf.train.Int64List(
-                                value=[label]))
-                    elif self._args['label_type'] == 'float':
-                        feature['label'] = tf.train.Feature(
-                            float_list=tf.train.FloatList(
-                                value=[label]))
-                    else:
-                        raise TypeError(
-                            'Label type other than "int" or "float" not '
-                            'implemented!')
-                else:
-                    # label = self._label_list[index]
-                    # assert label is None
+        :return: list, file names of the written files
+        """
+        num_shards = self._args['num_shards']
+        config = self.get_example_config()
+        if not num_shards or num_shards <= 1:
+            write_examples_file(file_name, self.get_split_data(split_index),
+                                labeled, config)
+            return [file_name]
+
+        root, ext = os.path.splitext(file_name)
+        shard_names = [SHARD_NAME_FORMAT.format(root, i, num_shards, ext)
+                       for i in xrange(num_shards)]
+        # contiguous shards so that reading the shards in order gives the
+        # same order as an unsharded file
+        tasks = [(shard_name, self.get_split_data(shard_index), labeled,
+                  config, False)
+                 for shard_name, shard_index in
+                 zip(shard_names, np.array_split(split_index, num_shards))]
+
+        num_workers = min(self._args['num_workers'] or 1, num_shards)
+        print('Writing {} shards with {} worker processes...'.format(
+            num_shards, num_workers))
+        if num_workers <= 1:
+            for task in tqdm(tasks):
+                write_examples_shard(task)
+        else:
+            pool = multiprocessing.Pool(processes=num_workers)
+            try:
+                for _ in tqdm(pool.imap_unordered(write_examples_shard, tasks),
+                              total=num_shards):
                     pass
+            finally:
+                pool.close()
+                pool.join()
+        return shard_names
+
+    def get_split_data(self, split_index):
+        """Gathers everything needed to write the examples of split_index"""
+        split_index = np.asarray(split_index, dtype=np.int64)
+        return {
+            'index': split_index,
+            'sequences': {name: self._sequences[name].take(split_index)
+                          for name in self._args['text_field_names']},
+            'lengths': {name: self._sequence_lengths[name][split_index]
+                        for name in self._args['text_field_names']},
+            'weights': {name: [self._weights[name][i] for i in split_index]
+                        for name in self._weights},
+            'labels': [self._label_list[i] for i in split_index],
+            'ids': [self._ids[i] for i in split_index] if self._ids else None
+        }
 
-                if self._args['write_tfidf']:
-                    raise NotImplementedError("tfidf not supported")
-                    # feature['tfidf'] = tf.train.Feature(
-                    #   float_list=tf.train.FloatList(
-                    #     value=self._tfidf_list[index]
-                    #   )
-                    # )
+    def get_example_config(self):
+        config = {k: self._args[k] for k in ['text_field_names', 'label_type',
+                                             'vocab_size', 'write_bow',
+                                             'write_tfidf']}
+        config['idf'] = self._idf
+        return config
+
+    def get_idf(self):
+        """Computes the idf values of the training data, or loads the ones
+        of the data the vocabulary comes from"""
+        idf_path = os.path.join(self._vocab_dir, 'idf.npy')
+        if os.path.exists(idf_path) and self._vocab_dir != self._tfrecord_dir:
+            print('Use idf values:', idf_path)
+            self._idf = np.load(idf_path)
+            assert len(self._idf) == self._args['vocab_size']
+            return
+        if self._args['predict_mode']:
+            raise ValueError('idf values of the training data not found: %s'
+                             % idf_path)
+
+        # every text field of every training example is a document, the same
+        # as when building the vocabulary
+        print('Computing idf values from the training data...')
+        doc_types = [
+            get_type_features(
+                self._sequences[text_field_name].take(self._train_index),
+                self._args['vocab_size'], write_bow=False)['types'].values
+            for text_field_name in self._args['text_field_names']]
+        self._idf = inverse_document_frequencies(
+            np.concatenate(doc_types),
+            len(self._train_index) * len(self._args['text_field_names']),
+            self._args['vocab_size'])
 
-                example = tf.train.Example(
-                    features=tf.train.Features(
-                        feature=feature))
-                writer.write(example.SerializeToString())
+        make_dir(self._tfrecord_dir)
+        self._args['idf_path'] = os.path.join(self._tfrecord_dir, 'idf.npy')
+        np.save(self._args['idf_path'], self._idf)
 
     def split(self, index_path, train_ratio, valid_ratio, random_seed,
               subsample_ratio):
@@ -1042,29 +1166,20 @@ def merge_save_vocab_dicts(vocab_paths, save_path):
     :param save_path: path to save the merged vocab
     :return:
     """
-    merged_vocab_dict = dict()
+    # counts are added in place, linear in the total size of the dictionaries
+    merged_vocab_counter = collections.Counter()
     for path in vocab_paths:
         with codecs.open(path, mode='r', encoding='utf-8') as file:
-            vocab_dict = json.load(file)
-            merged_vocab_dict = combine_dicts(merged_vocab_dict, vocab_dict)
+            merged_vocab_counter.update(json.load(file))
 
     # sort merged vocabulary according to frequency
-    merged_vocab_list = sorted(merged_vocab_dict.items(),
-                               key=operator.itemgetter(1),
-                               reverse=True)
-    merged_vocab_dict = dict()
-    for i in merged_vocab_list:
-        merged_vocab_dict[i[0]] = i[1]
+    merged_vocab_dict = collections.OrderedDict(
+        merged_vocab_counter.most_common())
 
     with codecs.open(save_path, mode='w', encoding='utf-8') as file:
         json.dump(merged_vocab_dict, file, ensure_ascii=False, indent=4)
 
 
-def combine_dicts(x, y):
-    return {i: x.get(i, 0) + y.get(i, 0) for i in
-            set(itertools.chain(x, y))}
-
-
 def merge_dict_write_tfrecord(json_dirs,
                               tfrecord_dirs,
                               merged_dir,
@@ -1085,10 +1200,15 @@ def merge_dict_write_tfrecord(json_dirs,
                               write_bow=False,
                               write_tfidf=False,
                               preproc=True,
-                              vocab_all=False):
+                              vocab_all=False,
+                              num_workers=1,
+                              token_cache=False,
+                              token_cache_dir=None,
+                              stream_data=False,
+                              num_shards=1):
     """Merge all the dictionaries for each dataset and write TFRecord files
 
-    1. generate word frequency dictionary for each dataset
+    1. count the words of each dataset's training data
     2. add them up to a new word frequency dictionary
     3. generate the word id mapping using arguments
     4. use the same word id mapping to generate TFRecord files for each dataset
@@ -1096,18 +1216,28 @@ def merge_dict_write_tfrecord(json_dirs,
     :param json_dirs: list of dataset(in json.gz) directories
     :param tfrecord_dirs: list of directories to save the TFRecord files
     :param merged_dir: new directory to save all the data
+    :param num_workers: number of processes used to tokenize the text
+    :param token_cache: whether to cache the tokenized text of each dataset
+    :param token_cache_dir: directory of the tokenized text caches, the
+        TFRecord directory of each dataset if None
+    :param stream_data: whether to read the examples of each dataset one at a
+        time
+    :param num_shards: number of TFRecord files each split is written to
     :return: args_dicts: list of args(dict) of each dataset
     """
 
-    # generate vocab for every dataset without writing their own TFRecord files
-    # the generated vocab freq dicts shall be saved at
-    # json_dir/vocab_freq_dict.json
+    # tokenize every dataset(with num_workers processes) without writing
+    # their own TFRecord files and add up the counts of the words of their
+    # training docs in memory; Counter.update() runs at C speed, so the
+    # counting is done in this process instead of sending the tokens to
+    # worker processes again
 
     # Assumes that all datasets have
     # the same text_field_names and label_field_name
     # max_document_lengths = []
+    merged_vocab_counter = collections.Counter()
     for json_dir, tfrecord_dir in zip(json_dirs, tfrecord_dirs):
-        dataset = Dataset(json_dir,
+        dataset = Dataset(json_dir=json_dir,
                           tfrecord_dir=tfrecord_dir,
                           vocab_dir=merged_dir,
                           max_document_length=max_document_length,
@@ -1120,22 +1250,33 @@ def merge_dict_write_tfrecord(json_dirs,
                           tokenizer_=tokenizer_,
                           stemmer=stemmer,
                           stopwords=stopwords,
-                          generate_basic_vocab=True,
+                          generate_basic_vocab=False,
                           vocab_given=False,
                           generate_tf_record=False,
                           preproc=preproc,
-                          vocab_all=vocab_all)
+                          vocab_all=vocab_all,
+                          num_workers=num_workers,
+                          token_cache=token_cache,
+                          token_cache_dir=token_cache_dir,
+                          stream_data=stream_data,
+                          num_shards=num_shards)
         # max_document_lengths.append(dataset.max_document_length)
+        for tokens in dataset.get_training_docs():
+            merged_vocab_counter.update(tokens)
+        del dataset
     # if max_document_length == -1:
     #   max_document_length = max(max_document_lengths)
 
-    # merge all the vocabularies
-    vocab_paths = []
-    for json_dir in json_dirs:
-        vocab_path = os.path.join(json_dir, "vocab_freq.json")
-        vocab_paths.append(vocab_path)
-    merge_save_vocab_dicts(vocab_paths, os.path.join(merged_dir,
-                                                     "vocab_freq.json"))
+    # the unknown token is never counted, as in the basic vocabularies
+    merged_vocab_counter.pop(OOV, None)
+
+    # sort merged vocabulary according to frequency
+    merged_vocab_dict = collections.OrderedDict(
+        merged_vocab_counter.most_common())
+    make_dir(merged_dir)
+    with codecs.open(os.path.join(merged_dir, 'vocab_freq.json'),
+                     mode='w', encoding='utf-8') as file:
+        json.dump(merged_vocab_dict, file, ensure_ascii=False, indent=4)
 
     print("merged public word frequency dictionary saved to path",
           os.path.join(merged_dir, "vocab_freq.json"))
@@ -1208,7 +1349,12 @@ def merge_dict_write_tfrecord(json_dirs,
                           stemmer=stemmer,
                           stopwords='nltk',
                           preproc=preproc,
-                          vocab_all=vocab_all
+                          vocab_all=vocab_all,
+                          num_workers=num_workers,
+                          token_cache=token_cache,
+                          token_cache_dir=token_cache_dir,
+                          stream_data=stream_data,
+                          num_shards=num_shards
                           )
         args_dicts.append(dataset.args)
 
@@ -1240,7 +1386,12 @@ def merge_pretrain_write_tfrecord(json_dirs,
                                   expand_vocab=False,
                                   pretrained_only=True,
                                   preproc=True,
-                                  vocab_all=True):
+                                  vocab_all=True,
+                                  num_workers=1,
+                                  token_cache=False,
+                                  token_cache_dir=None,
+                                  stream_data=False,
+                                  num_shards=1):
     """Use the dictionary of the pre-trained word embedding, combine the words
 
     from the training data of all the datasets if necessary
@@ -1254,6 +1405,13 @@ def merge_pretrain_write_tfrecord(json_dirs,
     :param json_dirs: list of dataset(in json.gz) directories
     :param tfrecord_dirs: list of directories to save the TFRecord files
     :param merged_dir: new directory to save all the data
+    :param num_workers: number of processes used to tokenize the text
+    :param token_cache: whether to cache the tokenized text of each dataset
+    :param token_cache_dir: directory of the tokenized text caches, the
+        TFRecord directory of each dataset if None
+    :param stream_data: whether to read the examples of each dataset one at a
+        time
+    :param num_shards: number of TFRecord files each split is written to
     :return: args_dicts: list of args(dict) of each dataset
     """
 
@@ -1291,7 +1449,12 @@ def merge_pretrain_write_tfrecord(json_dirs,
                           generate_tf_record=False,
                           preproc=preproc,
                           vocab_all=vocab_all,
-                          pretrained_only=pretrained_only)
+                          pretrained_only=pretrained_only,
+                          num_workers=num_workers,
+                          token_cache=token_cache,
+                          token_cache_dir=token_cache_dir,
+                          stream_data=stream_data,
+                          num_shards=num_shards)
         train_vocab_set = train_vocab_set.union(set(dataset.mapping))
         if padding:
             max_document_lengths.append(max_document_length)
@@ -1372,12 +1535,396 @@ def merge_pretrain_write_tfrecord(json_dirs,
                           stopwords='nltk',
                           preproc=preproc,
                           vocab_all=vocab_all,
-                          pretrained_only=pretrained_only)
+                          pretrained_only=pretrained_only,
+                          num_workers=num_workers,
+                          token_cache=token_cache,
+                          token_cache_dir=token_cache_dir,
+                          stream_data=stream_data,
+                          num_shards=num_shards)
         args_dicts.append(dataset.args)
 
     return args_dicts
 
 
+def get_tokenizer_fn(tokenizer_name):
+    if tokenizer_name == "tweet_tokenizer":
+        return tweet_tokenizer.tokenize
+    elif tokenizer_name == "tweet_tokenizer_keep_handles":
+        return tweet_tokenizer_keep_handles.tokenize
+    elif tokenizer_name == "ruder_tokenizer":
+        return functools.partial(ruder_tokenizer, preserve_case=False)
+    elif tokenizer_name == "split_tokenizer":
+        return functools.partial(split_tokenizer)
+    elif tokenizer_name == "lower_tokenizer":
+        return functools.partial(lower_tokenizer)
+    else:
+        raise ValueError("unrecognized tokenizer: %s" % tokenizer_name)
+
+
+def get_stemmer_fn(stemmer_name):
+    """Cached function stemming one token, None if not stemming"""
+    if not stemmer_name:
+        return None
+    return get_stem_fn(stemmer_name)
+
+
+def tokenize_example(item, text_field_names, tokenizer, stemmer, preproc_text,
+                     stopwords):
+    """Clean, tokenize, stem and remove stop words of one example
+
+    :param item: dict, one example read from data.json.gz
+    :param text_field_names: list of text field names to tokenize
+    :param tokenizer: tokenizer function
+    :param stemmer: function stemming one token(see get_stemmer_fn()) or None
+    :param preproc_text: whether to remove urls/tags and replace linebreaks
+    :param stopwords: stop words to remove, None/False to keep all the words
+    :return: (texts, weights), lists aligned with text_field_names, weights
+        are None if the example has no weights
+    """
+    texts = []
+    weights = []
+    for text_field_name in text_field_names:
+        text = item[text_field_name]
+
+        if preproc_text:
+            # same as stripping, preproc() and replacing the linebreaks, which
+            # are all removed by preproc()
+            text = fast_preproc(text)
+
+        text = tokenizer(text)
+
+        weight = None
+        if 'weight' in item:
+            weight = [float(w) for w in item['weight'].split()]
+
+        # stem, remove the stop words(and their weights) in one pass
+        text, weight = stem_and_remove_stopwords(
+            text, stem_fn=stemmer, stopwords='nltk' if stopwords else None,
+            weights=weight)
+
+        text = [BOS] + text + [EOS]
+        if weight is not None:
+            # TODO un-hardcode
+            # add 1.0 for BOS and EOS
+            weight = [1.0] + weight + [1.0]
+
+        texts.append(text)
+        weights.append(weight)
+
+    return texts, weights
+
+
+def tokenize_examples(examples, text_field_names, tokenizer_name,
+                      stemmer_name, preproc_text, stopwords):
+    """Tokenize a list of examples, used by the tokenizing worker processes
+
+    Tokenizer and stemmer are passed by name so that only strings are
+    pickled and sent to the workers.
+    """
+    tokenizer = get_tokenizer_fn(tokenizer_name)
+    stemmer = get_stemmer_fn(stemmer_name)
+    return [tokenize_example(item, text_field_names, tokenizer, stemmer,
+                             preproc_text, stopwords)
+            for item in examples]
+
+
+def get_token_cache_key(data_file_name, text_field_names, tokenizer_name,
+                        stemmer_name, stopwords, preproc_text):
+    """Hash of the data file, the arguments used to tokenize its text and
+    TOKEN_CACHE_VERSION"""
+    sha1 = hashlib.sha1()
+    with open(data_file_name, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(block)
+    config = json.dumps([TOKEN_CACHE_VERSION, text_field_names,
+                         tokenizer_name, stemmer_name, stopwords,
+                         preproc_text], sort_keys=True)
+    sha1.update(config.encode('utf-8'))
+    return sha1.hexdigest()
+
+
+class FlatSequences(object):
+    """Variable length word id sequences stored CSR-style
+
+    All the ids are kept in one flat int32 array and sequence i is
+    values[offsets[i]:offsets[i + 1]], which takes 4 bytes per token instead
+    of a Python int per token.
+    """
+
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_arrays(cls, arrays, lengths):
+        """Builds from an iterable of id arrays whose lengths are known
+
+        The flat buffer is allocated once so no intermediate copy of the
+        sequences is made.
+        """
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = np.empty(offsets[-1], dtype=np.int32)
+        num_arrays = 0
+        for i, array in enumerate(arrays):
+            assert len(array) == lengths[i], (i, len(array), lengths[i])
+            values[offsets[i]:offsets[i + 1]] = array
+            num_arrays += 1
+        assert num_arrays == len(lengths), (num_arrays, len(lengths))
+        return cls(values, offsets)
+
+    def take(self, indices):
+        """Returns a new FlatSequences with the sequences at indices"""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # position of every gathered id in self.values
+        positions = np.arange(offsets[-1], dtype=np.int64) + np.repeat(
+            starts - offsets[:-1], lengths)
+        return FlatSequences(self.values[positions], offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+
+def read_json_examples(file_name, buffer_size=1 << 20):
+    """Yields the examples of a gzipped json file one at a time
+
+    Both a json array of examples(the format of data.json.gz) and json lines
+    (one example per line) are accepted. The file is decoded incrementally, so
+    at most one buffer of text is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    with gzip.open(file_name, mode='rt', encoding='utf-8') as file:
+        buf = ''
+        pos = 0
+        eof = False
+        in_array = None
+        while True:
+            # skip the whitespace and the commas between two examples
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buf):
+                if eof:
+                    break
+                buf = file.read(buffer_size)
+                pos = 0
+                eof = not buf
+                continue
+
+            if in_array is None:
+                in_array = buf[pos] == '['
+                if in_array:
+                    pos += 1
+                    continue
+            if in_array and buf[pos] == ']':
+                break
+
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # the example continues in the next buffer
+                if eof:
+                    raise
+                chunk = file.read(buffer_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+
+
+def iter_chunks(iterable, chunk_size):
+    """Groups an iterable into lists of chunk_size items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def split_chunks(data, num_chunks):
+    """Split a list into at most num_chunks contiguous chunks"""
+    chunk_size = max(1, int(np.ceil(len(data) / float(num_chunks))))
+    return [data[i:i + chunk_size] for i in xrange(0, len(data), chunk_size)]
+
+
+def write_examples_shard(task):
+    # module level so that it can be sent to the worker processes
+    write_examples_file(*task)
+
+
+def write_examples_file(file_name, data, labeled, config, progress=True):
+    """Writes one tf.train.Example per row of data to a TFRecord file
+
+    :param data: dict returned by Dataset.get_split_data()
+    :param config: dict returned by Dataset.get_example_config()
+    :param progress: whether to show a progress bar
+    """
+    # types/counts/bow of all the examples at once
+    type_features = {
+        text_field_name: get_type_features(
+            data['sequences'][text_field_name], config['vocab_size'],
+            config['write_bow'])
+        for text_field_name in config['text_field_names']}
+    if config['write_bow']:
+        # reused for every example, only the types set are reset
+        bow = np.zeros(config['vocab_size'], dtype=np.float32)
+    if config['write_tfidf']:
+        for features in type_features.values():
+            # aligned with the types
+            features['tfidf'] = FlatSequences(
+                sparse_tfidf(features['types'].values,
+                             features['counts'].values,
+                             features['types'].offsets,
+                             config['idf']),
+                features['types'].offsets)
+
+    tf.logging.info("Writing to: %s", file_name)
+    with tf.python_io.TFRecordWriter(file_name) as writer:
+        for row in tqdm(xrange(len(data['index'])), disable=not progress):
+            feature = dict()
+
+            # Gather sequences and sequence statistics
+            feature['index'] = tf.train.Feature(
+                int64_list=tf.train.Int64List(
+                    value=[int(data['index'][row])]))
+
+            if data['ids']:
+                feature['id'] = tf.train.Feature(
+                    bytes_list=tf.train.BytesList(
+                        value=[str(data['ids'][row]).encode('utf-8')]))
+
+            for text_field_name in config['text_field_names']:
+                sequence = data['sequences'][text_field_name][row].tolist()
+                feature[text_field_name] = tf.train.Feature(
+                    int64_list=tf.train.Int64List(value=sequence))
+                feature[text_field_name + '_length'] = tf.train.Feature(
+                    int64_list=tf.train.Int64List(
+                        value=[int(data['lengths'][text_field_name][row])]))
+
+                if data['weights']:
+                    feature[
+                        text_field_name + '_weights'] = tf.train.Feature(
+                        float_list=tf.train.FloatList(
+                            value=data['weights'][text_field_name][row])
+                    )
+
+                # including BOS and EOS
+                types = type_features[text_field_name]['types'][row]
+                counts = type_features[text_field_name]['counts'][row]
+
+                feature[text_field_name + '_types'] = tf.train.Feature(
+                    int64_list=tf.train.Int64List(value=types.tolist()))
+                feature[
+                    text_field_name + '_type_counts'] = tf.train.Feature(
+                    int64_list=tf.train.Int64List(value=counts.tolist()))
+                feature[
+                    text_field_name + '_types_length'] = tf.train.Feature(
+                    int64_list=tf.train.Int64List(value=[len(types)]))
+
+                if config['write_bow']:
+                    # This assumes a single vocabulary shared among all sequence kinds
+                    bow[types] = type_features[text_field_name]['bow'][row]
+                    feature[text_field_name + '_bow'] = tf.train.Feature(
+                        float_list=tf.train.FloatList(value=bow.tolist()))
+                    bow[types] = 0
+
+                if config['write_tfidf']:
+                    # sparse, the indices are the ones in _types
+                    feature[text_field_name + '_tfidf'] = tf.train.Feature(
+                        float_list=tf.train.FloatList(
+                            value=type_features[text_field_name]['tfidf'][
+                                row].tolist()))
+
+                # if self._args['write_unique']:
+                #   feature[text_field_name + '_unique'] = tf.train.Feature(
+                #     int64_list=tf.train.Int64List(
+                #       value=list(OrderedDict.fromkeys(
+                #         self._sequences[text_field_name][index]))))  # keep order
+
+            # Gather label
+
+            if labeled:
+                label = data['labels'][row]
+                assert label is not None
+
+                if config['label_type'] == 'int':
+                    feature['label'] = tf.train.Feature(
+                        int64_list=tf.train.Int64List(
+                            value=[label]))
+                elif config['label_type'] == 'float':
+                    feature['label'] = tf.train.Feature(
+                        float_list=tf.train.FloatList(
+                            value=[label]))
+                else:
+                    raise TypeError(
+                        'Label type other than "int" or "float" not '
+                        'implemented!')
+            else:
+                # label = self._label_list[index]
+                # assert label is None
+                pass
+
+            example = tf.train.Example(
+                features=tf.train.Features(
+                    feature=feature))
+            writer.write(example.SerializeToString())
+
+
+def get_type_features(sequences, vocab_size, write_bow):
+    """Computes the word types and their counts of all the sequences at once
+
+    The ids are checked against vocab_size once for all the sequences.
+
+    :param sequences: FlatSequences
+    :param write_bow: whether to also compute the bag of words value of each
+        sequence, the same as bag_of_words(sequence, vocab_size)'s non-zero
+        entries
+    :return: dict, 'types' and 'counts' as FlatSequences with each sequence's
+        sorted types and their counts, and 'bow' the value of each sequence's
+        types in its bag of words
+    """
+    lengths = sequences.lengths()
+    assert np.all(lengths > 0), 'empty sequence'
+    if len(sequences.values):
+        assert sequences.values.min() >= 0
+        assert sequences.values.max() < vocab_size
+
+    # encode (sequence, id) pairs as one int64 so that one np.unique gives
+    # the types of every sequence, sorted by sequence first
+    rows = np.repeat(np.arange(len(sequences), dtype=np.int64), lengths)
+    keys, counts = np.unique(rows * vocab_size + sequences.values,
+                             return_counts=True)
+    num_types = np.bincount(keys // vocab_size, minlength=len(sequences))
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum(num_types, out=offsets[1:])
+
+    type_features = {
+        'types': FlatSequences(keys % vocab_size, offsets),
+        'counts': FlatSequences(counts, offsets),
+        'bow': None
+    }
+    if write_bow:
+        # binary bag of words normalized by its l2 norm
+        type_features['bow'] = np.float32(1) / (
+            np.sqrt(num_types.astype(np.float32)) + np.finfo(np.float32).eps)
+    return type_features
+
+
 def get_types_and_counts(token_list):
     counts = {x: token_list.count(x) for x in token_list}
     return counts.keys(), counts.values()
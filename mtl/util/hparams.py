@@ -58,6 +58,7 @@ def str2func(s):
     from mtl.embedders.pretrained import (init_pretrained,
                                           expand_pretrained,
                                           only_pretrained)
+    from mtl.embedders.sparse_bow import sparse_bow_embedding
     from mtl.extractors.cnn import cnn_extractor
     from mtl.extractors.dan import dan
     from mtl.extractors.lbirnn import (lbirnn,
@@ -77,6 +78,7 @@ def str2func(s):
         "init_pretrained": init_pretrained,
         "expand_pretrained": expand_pretrained,
         "only_pretrained": only_pretrained,
+        "sparse_bow_embedding": sparse_bow_embedding,
 
         "paragram": paragram_phrase,
         "serial_paragram": paragram_phrase,  # deprecated key
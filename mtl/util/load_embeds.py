@@ -22,13 +22,96 @@ that of the training dataset(s)"""
 from __future__ import unicode_literals
 
 import array
+import hashlib
 import io
+import os
+import threading
 from zipfile import ZipFile
 
 import numpy as np
 from gensim.models import KeyedVectors
 from tqdm import tqdm
 
+from mtl.util.constants import (EMBEDDING_STORE_EXT,
+                                EMBEDDING_VOCAB_EXT,
+                                PRETRAINED_EXTS)
+
+# process-wide cache of the loaded pretrained embeddings, so that each
+# embedding file is read at most once however many graphs are built
+_cache = {}
+_cache_lock = threading.RLock()
+
+
+def _cached(kind, filepath, load_fn, *key):
+    """Returns load_fn() and caches it under the path and the modification
+    time of filepath, so an updated file is read again"""
+    cache_key = (kind, os.path.abspath(filepath),
+                 os.path.getmtime(filepath)) + key
+    with _cache_lock:
+        if cache_key not in _cache:
+            _cache[cache_key] = load_fn()
+        return _cache[cache_key]
+
+
+def clear_embedding_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def get_pretrained_matrix(filepath, dtype=np.float32):
+    """Cached load_pretrained_matrix() converted to dtype"""
+    dtype = np.dtype(dtype)
+    return _cached('matrix', filepath,
+                   lambda: load_pretrained_matrix(filepath).astype(
+                       dtype, copy=False),
+                   dtype.str)
+
+
+def get_pretrained_vocab_dict(filepath):
+    """Cached load_pretrianed_vocab_dict()"""
+    return _cached('vocab', filepath,
+                   lambda: load_pretrianed_vocab_dict(filepath))
+
+
+def get_pretrained_rows(filepath, words, dtype=np.float32):
+    """Cached load_pretrained_rows(), gathered from the cached matrix if it
+    has been loaded already"""
+    dtype = np.dtype(dtype)
+    words_hash = hashlib.sha1(
+        '\n'.join(words).encode('utf-8')).hexdigest()
+
+    def load_fn():
+        matrix_key = ('matrix', os.path.abspath(filepath),
+                      os.path.getmtime(filepath), dtype.str)
+        with _cache_lock:
+            matrix = _cache.get(matrix_key)
+        if matrix is None:
+            return load_pretrained_rows(filepath, words).astype(dtype,
+                                                                copy=False)
+        pretrained_vocab = get_pretrained_vocab_dict(filepath)
+        return matrix[[pretrained_vocab[v] for v in words]]
+
+    return _cached('rows', filepath, load_fn, dtype.str, words_hash)
+
+
+def get_pretrained_shape(filepath):
+    """Number and dimension of the pretrained vectors, without parsing the
+    vectors unless they are loaded already"""
+
+    def load_fn():
+        with _cache_lock:
+            for key, value in _cache.items():
+                if key[:3] == ('matrix', os.path.abspath(filepath),
+                               os.path.getmtime(filepath)):
+                    return value.shape
+        if filepath.endswith(EMBEDDING_STORE_EXT):
+            return np.load(filepath, mmap_mode='r').shape
+        if filepath.endswith('.bin.gz'):
+            return get_pretrained_matrix(filepath).shape
+        return get_text_embeddings_shape(filepath)
+
+    return _cached('shape', filepath, load_fn)
+
 
 def combine_vocab(pretrained_path, train_vocab_list):
     """Expand the training vocab with the pretrained embedding vocabulary.
@@ -40,7 +123,7 @@ def combine_vocab(pretrained_path, train_vocab_list):
     :param train_vocab_list: list, all the word types in the training data
     :return: pretrained vocab + training vocab
     """
-    pretrained_vocab_dict = load_pretrianed_vocab_dict(
+    pretrained_vocab_dict = get_pretrained_vocab_dict(
         pretrained_path)  # used to create the
     # final vocab and keep order
     pretrained_vocab_dict = set(
@@ -84,7 +167,7 @@ def reorder_vocab(pretrained_path, training_vocab_list):
     :param training_vocab_list: list, all the word types in the training data
     :return: reordered vocab
     """
-    pretrained_vocab_dict = load_pretrianed_vocab_dict(
+    pretrained_vocab_dict = get_pretrained_vocab_dict(
         pretrained_path)  # used to create the
     # final vocab and keep order
     pretrained_vocab_set = set(
@@ -115,7 +198,10 @@ def load_pretrained_matrix(filepath):
     print('Loading embedding matrix from {}...'.format(filepath))
 
     num = 0
-    if filepath.endswith('.bin.gz'):  # word2vec
+    if filepath.endswith(EMBEDDING_STORE_EXT):  # converted
+        # memory-mapped, rows are only read from disk when used
+        word_vectors = np.load(filepath, mmap_mode='r')
+    elif filepath.endswith('.bin.gz'):  # word2vec
         word_vectors = []
         model = KeyedVectors.load_word2vec_format(filepath, binary=True)
         vocab_list = {v: i for i, v in enumerate(list(model.vocab.keys()))}
@@ -158,7 +244,10 @@ def load_pretrianed_vocab_dict(filepath):
     """
     print('Loading pretrained embedding dictionary from {}...'.format(filepath))
 
-    if 'bin' in filepath:
+    if filepath.endswith(EMBEDDING_STORE_EXT):  # converted
+        vocab_dict = {v: i for i, v in enumerate(
+            load_embedding_vocab(get_embedding_vocab_path(filepath)))}
+    elif 'bin' in filepath:
         vocab_dict = {v: i for i, v in enumerate(list(
             KeyedVectors.load_word2vec_format(
                 filepath,
@@ -183,6 +272,189 @@ def load_pretrianed_vocab_dict(filepath):
     return vocab_dict
 
 
+def get_embedding_store_path(filepath):
+    """Path of the .npy matrix filepath is converted to, e.g.
+    glove.6B.50d.txt -> glove.6B.50d.npy"""
+    for ext in PRETRAINED_EXTS:
+        if filepath.endswith(ext):
+            return filepath[:-len(ext)] + EMBEDDING_STORE_EXT
+    raise ValueError('No such embedding file as {}!'.format(filepath))
+
+
+def get_embedding_vocab_path(store_path):
+    """Path of the vocabulary file of a converted .npy matrix"""
+    return os.path.splitext(store_path)[0] + EMBEDDING_VOCAB_EXT
+
+
+def load_embedding_vocab(vocab_path):
+    """Load the words of a converted embedding file, in the order of the
+    rows of its matrix"""
+    with io.open(vocab_path, 'r', encoding='utf-8', newline='\n') as file:
+        words = file.read().split('\n')
+    # the file ends with a line break
+    assert words[-1] == '', vocab_path
+    return words[:-1]
+
+
+def iter_text_embeddings(filepath, words=None):
+    """Yield (word, vector) of a Glove .txt or fasttext .zip file
+
+    The words are split the same way as load_pretrianed_vocab_dict() and the
+    vectors the same way as load_pretrained_matrix().
+
+    :param words: if given, only the lines of these words are yielded, the
+        vectors of the other lines are not parsed
+    """
+    if filepath.endswith('.txt'):  # glove
+        with io.open(filepath, 'r', encoding='utf-8') as file:
+            for line in file:
+                delimiter = '\t' if '\t' in line else ' '
+                word = line.split(delimiter)[0]
+                if words is None or word in words:
+                    yield (word,
+                           np.asarray(line.rstrip('\n').split(' ')[1:],
+                                      dtype=np.float32))
+    elif filepath.endswith('.zip'):  # fasttext
+        with ZipFile(filepath, 'r') as myzip:
+            with myzip.open(filepath[filepath.rfind('/') + 1:filepath.find(
+                    '.zip')]) as file:
+                file.readline()
+                for line in file:
+                    line = line.decode('utf-8')
+                    word = line.split(' ')[0]
+                    if words is None or word in words:
+                        yield (word,
+                               np.asarray(line.rstrip('\n').split(' ')[1:],
+                                          dtype=np.float32))
+    else:
+        raise ValueError('No such embedding file as {}!'.format(filepath))
+
+
+def load_pretrained_rows(filepath, words):
+    """Load the pretrained vectors of the given words only
+
+    Text files are read once and only the lines of the given words are
+    parsed; converted .npy files only read the rows of the given words.
+
+    :param filepath: full file path of the pretrained embedding file
+    :param words: list of words, all in the pretrained vocabulary
+    :return: np array of shape [len(words), dim], row i is the vector of
+        words[i]
+    """
+    print('Loading the embeddings of {} words from {}...'.format(
+        len(words), filepath))
+
+    if filepath.endswith(EMBEDDING_STORE_EXT):  # converted
+        pretrained_vocab = load_pretrianed_vocab_dict(filepath)
+        missing = [v for v in words if v not in pretrained_vocab]
+        if missing:
+            raise ValueError('{} words are not in {}, e.g. {}'.format(
+                len(missing), filepath, missing[:10]))
+        rows = np.fromiter((pretrained_vocab[v] for v in words),
+                           dtype=np.int64, count=len(words))
+        return np.asarray(load_pretrained_matrix(filepath)[rows],
+                          dtype=np.float32)
+
+    if filepath.endswith('.bin.gz'):  # word2vec
+        model = KeyedVectors.load_word2vec_format(filepath, binary=True)
+        missing = [v for v in words if v not in model.vocab]
+        if missing:
+            raise ValueError('{} words are not in {}, e.g. {}'.format(
+                len(missing), filepath, missing[:10]))
+        return np.asarray([model.get_vector(v) for v in words],
+                          dtype=np.float32).reshape(len(words),
+                                                    model.vector_size)
+
+    word2row = {v: i for i, v in enumerate(words)}
+    matrix = None
+    found = np.zeros(len(words), dtype=np.bool_)
+    for word, vector in tqdm(iter_text_embeddings(filepath, word2row)):
+        if matrix is None:
+            matrix = np.zeros([len(words), len(vector)], dtype=np.float32)
+        # a later line of the same word overrides the earlier one, as in
+        # load_pretrianed_vocab_dict()
+        matrix[word2row[word]] = vector
+        found[word2row[word]] = True
+    if not found.all():
+        missing = [v for v, f in zip(words, found) if not f]
+        raise ValueError('{} words are not in {}, e.g. {}'.format(
+            len(missing), filepath, missing[:10]))
+    return matrix
+
+
+def get_text_embeddings_shape(filepath):
+    """Number and dimension of the vectors of a Glove .txt or fasttext .zip
+    file, without parsing the vectors"""
+    if filepath.endswith('.txt'):  # glove
+        with io.open(filepath, 'r', encoding='utf-8') as file:
+            dim = len(file.readline().split(' ')) - 1
+        num = 0
+        with io.open(filepath, 'rb') as file:
+            last_block = b''
+            for block in iter(lambda: file.read(1 << 24), b''):
+                num += block.count(b'\n')
+                last_block = block
+        if last_block and not last_block.endswith(b'\n'):
+            num += 1
+        return num, dim
+    elif filepath.endswith('.zip'):  # fasttext
+        with ZipFile(filepath, 'r') as myzip:
+            with myzip.open(filepath[filepath.rfind('/') + 1:filepath.find(
+                    '.zip')]) as file:
+                num, dim = map(int, file.readline().split())
+        return num, dim
+    raise ValueError('No such embedding file as {}!'.format(filepath))
+
+
+def convert_pretrained(filepath, store_path=None):
+    """Convert a pretrained word embedding file to a float32 .npy matrix and
+    a vocabulary file with one word per line
+
+    The converted matrix is loaded by load_pretrained_matrix() memory-mapped
+    and its vocabulary by load_pretrianed_vocab_dict(), with the same word
+    ids as the original file.
+
+    :param filepath: full file path of the pretrained embedding file
+    :param store_path: path of the .npy file to write, defaults to filepath
+        with its extension replaced by .npy
+    :return: path of the .npy file
+    """
+    if store_path is None:
+        store_path = get_embedding_store_path(filepath)
+    if not store_path.endswith(EMBEDDING_STORE_EXT):
+        raise ValueError('{} is not a {} file!'.format(store_path,
+                                                       EMBEDDING_STORE_EXT))
+    print('Converting {} to {}...'.format(filepath, store_path))
+
+    if filepath.endswith('.bin.gz'):  # word2vec
+        model = KeyedVectors.load_word2vec_format(filepath, binary=True)
+        words = list(model.vocab.keys())
+        num, dim = len(words), model.vector_size
+        vectors = ((v, model.get_vector(v)) for v in words)
+    else:
+        num, dim = get_text_embeddings_shape(filepath)
+        vectors = iter_text_embeddings(filepath)
+
+    # rows are written straight into the file, the whole matrix is never
+    # held in memory
+    matrix = np.lib.format.open_memmap(store_path, mode='w+',
+                                       dtype=np.float32, shape=(num, dim))
+    i = 0
+    with io.open(get_embedding_vocab_path(store_path), 'w',
+                 encoding='utf-8', newline='\n') as vocab_file:
+        for i, (word, vector) in tqdm(enumerate(vectors), total=num):
+            if len(vector) != dim:
+                raise ValueError('Line {} of {} has {} values, expected '
+                                 '{}!'.format(i, filepath, len(vector), dim))
+            matrix[i] = vector
+            vocab_file.write(word + '\n')
+    assert i + 1 == num, (i + 1, num)
+    matrix.flush()
+    del matrix
+
+    return store_path
+
+
 # load fasttext
 # https://fasttext.cc/docs/en/english-vectors.html
 def load_vectors(fname):
@@ -25,6 +25,9 @@ mae_macro:        macro-averaged(unweighted mean) mean absolute error
 recall_macro:     macro-averaged(unweighted mean) recall score
 precision_macro:  macro-averaged(unweighted mean) precision score
 
+StreamingMetrics accumulates a per-topic confusion tensor batch by batch and
+derives the classification metrics above from it
+
 More details see sklearn documentation
 http://scikit-learn.org/stable/modules/model_evaluation.html#model-evaluation
 """
@@ -251,6 +254,200 @@ def pearson_r(y_trues, y_preds, labels=None):
     return scipy.stats.pearsonr(y_trues, y_preds)
 
 
+def _safe_divide(numerator, denominator):
+    """element-wise division, 0 where the denominator is 0 (as in sklearn)"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    result = np.zeros_like(denominator)
+    mask = denominator > 0
+    result[mask] = numerator[mask] / denominator[mask]
+    return result
+
+
+class StreamingMetrics(object):
+    """Streaming accumulator of the classification metrics
+
+    counts[t, i, j] is the number of examples of topic t known to be in
+    class i but predicted to be in class j. Each eval batch is added with a
+    single np.bincount, and Acc, F1/Recall/Precision_Macro, Confusion_Matrix
+    and MAE_Macro are all derived from the counts, giving the same values as
+    the functions above over the concatenated batches.
+
+    Labels and predictions must be non-negative integer class ids.
+    """
+
+    def __init__(self, labels):
+        """
+        :param labels: labels for each class in a list, the classes the
+        macro-averaged metrics and the confusion matrix are computed over
+        """
+        self._labels = [int(label) for label in labels] if labels else []
+        num_classes = max(self._labels) + 1 if self._labels else 1
+        # topic value -> row in counts, None for examples without topics
+        self._topic_ids = dict()
+        self._counts = np.zeros([0, num_classes, num_classes],
+                                dtype=np.int64)
+
+    @property
+    def ntotal(self):
+        return int(self._counts.sum())
+
+    def _grow(self, num_topics, num_classes):
+        old_topics, old_classes, _ = self._counts.shape
+        if num_topics <= old_topics and num_classes <= old_classes:
+            return
+        counts = np.zeros([max(num_topics, old_topics),
+                           max(num_classes, old_classes),
+                           max(num_classes, old_classes)],
+                          dtype=np.int64)
+        counts[:old_topics, :old_classes, :old_classes] = self._counts
+        self._counts = counts
+
+    def update(self, y_trues, y_preds, topics=None):
+        """Add a batch of predictions
+
+        :param y_trues: array of ground truth labels
+        :param y_preds: array of predicted labels
+        :param topics: topic of each example, None or empty if not available
+        """
+        y_trues = np.asarray(y_trues, dtype=np.int64).ravel()
+        y_preds = np.asarray(y_preds, dtype=np.int64).ravel()
+        assert y_trues.shape == y_preds.shape
+        if y_trues.size == 0:
+            return
+
+        if topics is None or len(topics) == 0:
+            topics = np.zeros_like(y_trues)
+            topic_values = [None]
+        else:
+            # only the distinct topics of the batch are looked up
+            topic_values, topics = np.unique(np.asarray(topics),
+                                             return_inverse=True)
+            topic_values = topic_values.tolist()
+            assert topics.shape == y_trues.shape
+        topic_ids = np.array([self._topic_ids.setdefault(value,
+                                                         len(self._topic_ids))
+                              for value in topic_values], dtype=np.int64)
+
+        num_classes = max(self._counts.shape[1],
+                          int(y_trues.max()) + 1,
+                          int(y_preds.max()) + 1)
+        self._grow(len(self._topic_ids), num_classes)
+        num_topics, num_classes, _ = self._counts.shape
+
+        flat = (topic_ids[topics] * num_classes + y_trues) * num_classes
+        flat += y_preds
+        self._counts += np.bincount(
+            flat, minlength=num_topics * num_classes * num_classes).reshape(
+            self._counts.shape)
+
+    def add_confusion_matrix(self, matrix, topic=None):
+        """Add counts accumulated elsewhere(e.g. in the graph)
+
+        :param matrix: array, shape = [n_classes, n_classes], matrix[i, j]
+        is the number of examples of class i predicted to be in class j
+        :param topic: topic of all the examples, None if not available
+        """
+        matrix = np.asarray(matrix, dtype=np.int64)
+        assert matrix.ndim == 2 and matrix.shape[0] == matrix.shape[1]
+        row = self._topic_ids.setdefault(topic, len(self._topic_ids))
+        self._grow(len(self._topic_ids), matrix.shape[0])
+        self._counts[row, :matrix.shape[0], :matrix.shape[1]] += matrix
+
+    def _total(self):
+        """confusion matrix of all the classes summed over topics"""
+        return self._counts.sum(axis=0)
+
+    def _label_scores(self):
+        """precision, recall and f1 score of each label"""
+        assert self._labels
+        total = self._total()
+        tp = np.diagonal(total)[self._labels]
+        pred_sum = total.sum(axis=0)[self._labels]
+        true_sum = total.sum(axis=1)[self._labels]
+        return (_safe_divide(tp, pred_sum),
+                _safe_divide(tp, true_sum),
+                _safe_divide(2 * tp, pred_sum + true_sum))
+
+    def accurate_number(self):
+        return int(np.trace(self._total()))
+
+    def accuracy_score(self):
+        ntotal = self.ntotal
+        return float(self.accurate_number()) / ntotal if ntotal else 0.0
+
+    def f1_macro(self):
+        return float(np.mean(self._label_scores()[2]))
+
+    def f1_pos_neg_macro(self):
+        # same as f1_pos_neg_macro(): per-class scores of the classes that
+        # appear in the ground truth or the predictions, in sorted order
+        total = self._total()
+        present = np.flatnonzero(total.sum(axis=0) + total.sum(axis=1))
+        tp = np.diagonal(total)[present]
+        support = total.sum(axis=0)[present] + total.sum(axis=1)[present]
+        f1_scores = _safe_divide(2 * tp, support)
+        return float(np.mean([f1_scores[0], f1_scores[1]]))
+
+    def recall_macro(self):
+        return float(np.mean(self._label_scores()[1]))
+
+    def precision_macro(self):
+        return float(np.mean(self._label_scores()[0]))
+
+    def confusion_matrix(self):
+        assert self._labels
+        return self._total()[np.ix_(self._labels, self._labels)]
+
+    def mae_macro(self):
+        topic_rows = [row for value, row in self._topic_ids.items()
+                      if value is not None]
+        if not topic_rows:
+            return float('inf')
+        counts = self._counts[topic_rows]
+        # topics added without any example don't count
+        counts = counts[counts.sum(axis=(1, 2)) > 0]
+
+        # absolute error of every (true, predicted) cell
+        classes = np.arange(counts.shape[1])
+        abs_errors = np.abs(classes[:, np.newaxis] - classes[np.newaxis, :])
+        errors = (counts * abs_errors).sum(axis=2)
+        support = counts.sum(axis=2)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if self._labels:
+                # macro-average over the labels present in each topic as well
+                errors = errors[:, self._labels]
+                support = support[:, self._labels]
+                present = support > 0
+                maes = _safe_divide(errors, support).sum(axis=1)
+                maes /= present.sum(axis=1)
+            else:
+                maes = errors.sum(axis=1) / support.sum(axis=1)
+        return float(np.mean(maes))
+
+    def neg_mae_macro(self):
+        return -self.mae_macro()
+
+    def score(self, metric_name):
+        """value of the metric named as in metric2func()"""
+        metric2method = {
+            'Acc': self.accuracy_score,
+            'MAE_Macro': self.mae_macro,
+            'F1_Macro': self.f1_macro,
+            'F1_PosNeg_Macro': self.f1_pos_neg_macro,
+            'Neg_MAE_Macro': self.neg_mae_macro,
+            'Recall_Macro': self.recall_macro,
+            'Precision_Macro': self.precision_macro,
+            'Confusion_Matrix': self.confusion_matrix,
+        }
+        if metric_name in metric2method:
+            return metric2method[metric_name]()
+        else:
+            raise NotImplementedError(
+                'Streaming metric %s is not implemented!' % metric_name)
+
+
 def metric2func(metric_name):
     METRIC2FUNC = {
         'Acc': accuracy_score,
@@ -19,6 +19,11 @@ from __future__ import print_function
 
 import tensorflow as tf
 
+from mtl.optim.adafactor import AdafactorOptimizer
+
+OPTIMIZERS = ['adam', 'lazy_adam', 'nadam', 'sgd', 'adadelta', 'momentum',
+              'rmsprop', 'adafactor']
+
 
 class Optimizer(object):
     class H(object):
@@ -36,6 +41,10 @@ class Optimizer(object):
         adam_epsilon = 1e-6
         adam_beta1 = 0.85
         adam_beta2 = 0.997
+        adafactor_beta1 = 0.0
+        adafactor_factored = True
+        # float32, bfloat16 or float16
+        adafactor_slot_dtype = 'float32'
 
     def __init__(self, global_step=None, config=H):
         self._config = config
@@ -66,6 +75,14 @@ class Optimizer(object):
                                                epsilon=config.adam_epsilon,
                                                beta1=config.adam_beta1,
                                                beta2=config.adam_beta2)
+        elif config.optimizer == 'lazy_adam':
+            # Adam that only updates the moments and the variable rows that
+            # appear in sparse(e.g. embedding) gradients
+            self._opt = tf.contrib.opt.LazyAdamOptimizer(
+                learning_rate,
+                epsilon=config.adam_epsilon,
+                beta1=config.adam_beta1,
+                beta2=config.adam_beta2)
         elif config.optimizer == 'nadam':
             # Adam + Momentum
             self._opt = tf.contrib.opt.NadamOptimizer(learning_rate,
@@ -84,24 +101,61 @@ class Optimizer(object):
                 learning_rate, config.rmsprop_decay,
                 momentum=config.rmsprop_momentum,
                 epsilon=config.rmsprop_epsilon)
+        elif config.optimizer == 'adafactor':
+            # relative step sizes with its own schedule, learning rate unused
+            self._opt = AdafactorOptimizer(
+                beta1=config.adafactor_beta1,
+                factored=config.adafactor_factored,
+                slot_dtype=tf.as_dtype(config.adafactor_slot_dtype))
         else:
             raise ValueError(
                 'unrecognized optimizer: {}'.format(config.optimizer))
 
+        if config.optimizer != 'adafactor' and \
+            tf.as_dtype(getattr(config, 'adafactor_slot_dtype',
+                                'float32')) != tf.float32:
+            raise ValueError('low precision slots are only supported by '
+                             'adafactor, not {}'.format(config.optimizer))
+
     def assign_lr(self, session, lr_value):
         session.run(self._lr_update, feed_dict={self._new_lr: lr_value})
 
     def optimize(self, loss):
         return self.minimize(loss)
 
-    def minimize(self, loss):
-        tvars = tf.trainable_variables()
-        grads, _ = tf.clip_by_global_norm(tf.gradients(loss, tvars),
-                                          self.config.max_grad_norm)
-        self._train_op = self.opt.apply_gradients(zip(grads, tvars),
-                                                  global_step=self.global_step)
+    def minimize(self, loss, var_list=None, name=None):
+        # sparse gradients(IndexedSlices of embedding lookups) are kept
+        # sparse by the clipping and passed on to the optimizer as they are
+        if var_list is None:
+            var_list = tf.trainable_variables()
+        grads = tf.gradients(loss, var_list)
+        if self.config.max_grad_norm and self.config.max_grad_norm > 0:
+            grads, _ = tf.clip_by_global_norm(grads,
+                                              self.config.max_grad_norm)
+        self._train_op = self.opt.apply_gradients(
+            [(g, v) for g, v in zip(grads, var_list) if g is not None],
+            global_step=self.global_step,
+            name=name)
         return self.train_op
 
+    def state_bytes(self, var_list=None):
+        """Bytes of the optimizer slots(e.g. Adam's moments) of each variable
+
+        :return: list of (variable name, bytes of the variable, bytes of its
+            slots) of the variables that have slots
+        """
+        if var_list is None:
+            var_list = tf.global_variables()
+        result = []
+        for var in var_list:
+            slots = [self.opt.get_slot(var, name)
+                     for name in self.opt.get_slot_names()]
+            slots = [slot for slot in slots if slot is not None]
+            if slots:
+                result.append((var.op.name, num_bytes(var),
+                               sum(num_bytes(slot) for slot in slots)))
+        return result
+
     @property
     def opt(self):
         return self._opt
@@ -121,3 +175,7 @@ class Optimizer(object):
     @property
     def config(self):
         return self._config
+
+
+def num_bytes(var):
+    return var.get_shape().num_elements() * var.dtype.base_dtype.size
@@ -28,13 +28,29 @@ class Pipeline(object):
     def __init__(self, tfrecord_file, feature_map, batch_size=32,
                  num_threads=4, prefetch_buffer_size=1,
                  static_max_length=None, shuffle_buffer_size=10000,
-                 shuffle=True, num_epochs=None, one_shot=False):
+                 shuffle=True, num_epochs=None, one_shot=False,
+                 bucket_boundaries=None, bucket_length_keys=None):
+        # bucket_boundaries: if given, batch together examples whose length
+        #   falls in the same [boundaries[i-1], boundaries[i]) bucket so that
+        #   each batch is only padded to the longest example of its bucket
+        # bucket_length_keys: keys of the (scalar) length features; the
+        #   length of an example is the max of them
         self._feature_map = feature_map
         self._batch_size = batch_size
         self._static_max_length = static_max_length
 
         # Initialize the dataset
-        dataset = tf.data.TFRecordDataset(tfrecord_file)
+        if isinstance(tfrecord_file, (list, tuple)) and len(tfrecord_file) > 1:
+            # Read the shards of a split in parallel
+            files = tf.data.Dataset.from_tensor_slices(list(tfrecord_file))
+            if shuffle:
+                files = files.shuffle(len(tfrecord_file))
+            dataset = files.apply(tf.contrib.data.parallel_interleave(
+                tf.data.TFRecordDataset,
+                cycle_length=min(num_threads, len(tfrecord_file)),
+                sloppy=shuffle))
+        else:
+            dataset = tf.data.TFRecordDataset(tfrecord_file)
 
         # Maybe randomize
         if shuffle:
@@ -46,9 +62,24 @@ class Pipeline(object):
         elif num_epochs > 1:
             dataset = dataset.repeat(count=num_epochs)
 
-        dataset = dataset.batch(batch_size)
-        dataset = dataset.map(self.parse_example,
-                              num_parallel_calls=num_threads)
+        if bucket_boundaries:
+            # Parse one by one, then pad batches within each bucket
+            dataset = dataset.map(self.parse_single_example,
+                                  num_parallel_calls=num_threads)
+            dataset = dataset.apply(
+                tf.contrib.data.bucket_by_sequence_length(
+                    element_length_func=self.get_length_fn(
+                        bucket_length_keys),
+                    bucket_boundaries=list(bucket_boundaries),
+                    bucket_batch_sizes=[batch_size] * (
+                        len(bucket_boundaries) + 1)))
+            if self._static_max_length is not None:
+                dataset = dataset.map(self.pad_batch,
+                                      num_parallel_calls=num_threads)
+        else:
+            dataset = dataset.batch(batch_size)
+            dataset = dataset.map(self.parse_example,
+                                  num_parallel_calls=num_threads)
 
         # Pre-fetch a batch for faster processing
         dataset = dataset.prefetch(prefetch_buffer_size)
@@ -93,6 +124,36 @@ class Pipeline(object):
                 result.append(val)
         return tuple(result)
 
+    def parse_single_example(self, serialized):
+        parsed = parsing_ops.parse_single_example(serialized,
+                                                  self._feature_map)
+        result = []
+        for key in sorted(self._feature_map.keys()):
+            val = parsed[key]
+            if isinstance(val, sparse_tensor_lib.SparseTensor):
+                val = tf.sparse_tensor_to_dense(val)
+            result.append(val)
+        return tuple(result)
+
+    def get_length_fn(self, length_keys):
+        keys = sorted(self._feature_map.keys())
+        positions = [keys.index(key) for key in length_keys]
+
+        def length_fn(*example):
+            lengths = [tf.reshape(example[position], [])
+                       for position in positions]
+            return tf.cast(tf.reduce_max(tf.stack(lengths)), tf.int32)
+
+        return length_fn
+
+    def pad_batch(self, *batch):
+        result = []
+        for key, val in zip(sorted(self._feature_map.keys()), batch):
+            if isinstance(self._feature_map[key], tf.VarLenFeature):
+                val = self.pad(val)
+            result.append(val)
+        return tuple(result)
+
     @property
     def iterator(self):
         return self._iterator
@@ -0,0 +1,395 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+"""Predict raw text in-process with a trained model
+
+The model, vocabulary and tokenizer are loaded once, then each call of
+Predictor.predict() tokenizes the text, builds the id batches in memory and
+runs one session call, without writing JSON or TFRecord files.
+
+Example:
+
+    hps = set_hps(parse_args())  # the arguments the model was trained with
+    predictor = Predictor(hps, 'SSTb', 'data/ckpt/SSTb/SSTb/model')
+    predictor.predict(['a great movie', 'a boring movie'])
+
+MicroBatcher puts one Predictor behind concurrent callers, e.g. the requests
+of expts/scripts/prediction_server.py.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import codecs
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import tensorflow as tf
+from six.moves import queue
+
+from mtl.models.mult import Mult
+from mtl.util.categorical_vocabulary import CategoricalVocabulary
+from mtl.util.constants import OOV
+from mtl.util.dataset import (FlatSequences,
+                              get_stemmer_fn,
+                              get_tokenizer_fn,
+                              get_type_features,
+                              tokenize_example)
+from mtl.util.text import VocabularyProcessor, tokenizer_simple
+from mtl.util.util import sparse_tfidf
+
+# extractors that take is_training, see fill_pred_op_info() in
+# discriminative_driver.py
+IS_TRAINING_EXTRACTORS = ['serial_lbirnn', 'lbirnn', 'serial_lbirnn_stock',
+                          'dan']
+
+
+class Predictor(object):
+    def __init__(self, hps, dataset_name, checkpoint_path, config=None):
+        """
+        :param hps: the hyperparameters the model was trained with, i.e. the
+            HParams built from the arguments of discriminative_driver.py
+        :param dataset_name: the dataset whose labels to predict
+        :param checkpoint_path: path of the checkpoint to restore, e.g.
+            checkpoint_dir/dataset_name/model
+        :param config: tf.ConfigProto for the session
+        """
+        if dataset_name not in hps.datasets:
+            raise ValueError("Unrecognized dataset=%s" % dataset_name)
+        if hps.input_key not in ['tokens', 'bow', 'sparse_bow', 'tfidf']:
+            raise ValueError(
+                "Input key %s not supported!" % hps.input_key)
+
+        self._hps = hps
+        self._dataset_name = dataset_name
+
+        dataset_path = hps.dataset_paths[hps.datasets.index(dataset_name)]
+        with open(os.path.join(dataset_path, 'args.json')) as file:
+            self._args = json.load(file)
+        self._text_field_names = self._args['text_field_names']
+        self._tokenizer = get_tokenizer_fn(self._args['tokenizer_'])
+        self._stemmer = get_stemmer_fn(self._args['stemmer'])
+        self._vocab_size = int(self._args['vocab_size'])
+
+        with codecs.open(os.path.join(dataset_path, 'vocab_v2i.json'),
+                         mode='r', encoding='utf-8') as file:
+            vocab_v2i_dict = json.load(file)
+        self._vocab_processor = VocabularyProcessor(
+            vocabulary=CategoricalVocabulary(unknown_token=OOV,
+                                             mapping=vocab_v2i_dict),
+            max_document_length=self._args['max_document_length'],
+            tokenizer_fn=tokenizer_simple)
+
+        self._idf = None
+        if hps.input_key == 'tfidf':
+            self._idf = np.load(os.path.join(dataset_path, 'idf.npy'))
+
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._placeholders = self.build_placeholders()
+            model = Mult(class_sizes=dict(zip(hps.datasets, hps.class_sizes)),
+                         dataset_order=list(hps.datasets),
+                         hps=hps)
+            self._pred_op = model.get_pred_res(
+                self._placeholders,
+                dataset_name,
+                dataset_name,
+                hps.task,
+                additional_encoder_kwargs=self.get_additional_encoder_kwargs())
+            saver = tf.train.Saver()
+        self._sess = tf.Session(graph=self._graph, config=config)
+        saver.restore(self._sess, checkpoint_path)
+
+    def build_placeholders(self):
+        # same keys and dtypes as the features parsed by the driver
+        placeholders = {'id': tf.placeholder(tf.string, [None], name='id')}
+        for text_field_name in self._text_field_names:
+            names = [text_field_name + '_length']
+            if self._hps.input_key == 'tokens':
+                names.append(text_field_name)
+            elif self._hps.input_key in ['sparse_bow', 'tfidf']:
+                names += [text_field_name + '_types',
+                          text_field_name + '_type_counts']
+            for name in names:
+                placeholders[name] = tf.placeholder(
+                    tf.int64, [None] * (1 if name.endswith('_length') else 2),
+                    name=name)
+            if self._hps.input_key in ['bow', 'tfidf']:
+                name = text_field_name + '_' + self._hps.input_key
+                placeholders[name] = tf.placeholder(
+                    tf.float32,
+                    [None, self._vocab_size if self._hps.input_key == 'bow'
+                     else None],
+                    name=name)
+        return placeholders
+
+    def get_additional_encoder_kwargs(self):
+        with open(self._hps.encoder_config_file, 'r') as f:
+            encoders = json.load(f)
+        additional_encoder_kwargs = dict()
+        for dataset_name in self._hps.datasets:
+            additional_encoder_kwargs[dataset_name] = dict()
+            encoder = encoders[self._hps.architecture][dataset_name]
+            if encoder['embed_fn'] == 'pretrained' or \
+                    encoder['extract_fn'] in IS_TRAINING_EXTRACTORS:
+                additional_encoder_kwargs[dataset_name]['is_training'] = False
+        return additional_encoder_kwargs
+
+    def tokenize(self, examples):
+        """Run the same text pipeline as when writing the TFRecords
+
+        :return: dict, text field name -> FlatSequences of word ids
+        """
+        texts = [tokenize_example(example,
+                                  self._text_field_names,
+                                  self._tokenizer,
+                                  self._stemmer,
+                                  self._args['preproc'],
+                                  self._args['stopwords'])[0]
+                 for example in examples]
+        sequences = dict()
+        for i, text_field_name in enumerate(self._text_field_names):
+            docs = [text[i] for text in texts]
+            lengths = np.asarray([len(doc) for doc in docs], dtype=np.int64)
+            sequences[text_field_name] = (
+                FlatSequences(*self._vocab_processor.transform_flat(docs)),
+                lengths)
+        return sequences
+
+    def get_feed_dict(self, examples):
+        feed_dict = {self._placeholders['id']: [
+            str(example.get('id', i)) for i, example in enumerate(examples)]}
+        for text_field_name, (sequences, lengths) in self.tokenize(
+                examples).items():
+            feed_dict[self._placeholders[text_field_name + '_length']] = \
+                lengths
+            if self._hps.input_key == 'tokens':
+                max_len = max(sequences.lengths())
+                if self._args['padding']:
+                    max_len = self._args['max_document_length']
+                feed_dict[self._placeholders[text_field_name]] = pad(
+                    sequences, max_len)
+                continue
+
+            features = get_type_features(sequences, self._vocab_size,
+                                         write_bow=True)
+            types = features['types']
+            if self._hps.input_key == 'bow':
+                bow = np.zeros([len(sequences), self._vocab_size],
+                               dtype=np.float32)
+                rows = np.repeat(np.arange(len(sequences)), types.lengths())
+                bow[rows, types.values] = features['bow'][rows]
+                feed_dict[self._placeholders[text_field_name + '_bow']] = bow
+                continue
+
+            max_len = max(types.lengths())
+            feed_dict[self._placeholders[text_field_name + '_types']] = pad(
+                types, max_len)
+            feed_dict[self._placeholders[
+                text_field_name + '_type_counts']] = pad(
+                features['counts'], max_len)
+            if self._hps.input_key == 'tfidf':
+                tfidf = FlatSequences(sparse_tfidf(types.values,
+                                                   features['counts'].values,
+                                                   types.offsets,
+                                                   self._idf),
+                                      types.offsets)
+                feed_dict[self._placeholders[text_field_name + '_tfidf']] = \
+                    pad(tfidf, max_len, dtype=np.float32)
+        return feed_dict
+
+    def predict(self, texts):
+        """Predict a batch of text
+
+        :param texts: list of strings, or of dicts mapping each text field
+            name to its text(and optionally 'id'); a 'text' key is taken as
+            the first text field if the model has no field named 'text'
+        :return: list of (predicted label, scores) for classification, or
+            (rounded score, score) for regression, one per text
+        """
+        if not texts:
+            return []
+        examples = [self.get_example(text) for text in texts]
+        _, predictions, scores = self._sess.run(
+            self._pred_op, feed_dict=self.get_feed_dict(examples))
+        return list(zip(predictions.tolist(), scores.tolist()))
+
+    def get_example(self, text):
+        """The example of a string or a dict given to predict()"""
+        text_field_name = self._text_field_names[0]
+        if not isinstance(text, dict):
+            return {text_field_name: text}
+        if 'text' in text and 'text' not in self._text_field_names and \
+                text_field_name not in text:
+            example = dict(text)
+            example[text_field_name] = example.pop('text')
+            return example
+        return text
+
+    def close(self):
+        self._sess.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def pad(sequences, max_len, dtype=np.int64):
+    """Pads FlatSequences into a [num_sequences, max_len] array with 0"""
+    lengths = sequences.lengths()
+    rows = np.repeat(np.arange(len(sequences)), lengths)
+    columns = np.arange(len(sequences.values)) - np.repeat(
+        sequences.offsets[:-1], lengths)
+    padded = np.zeros([len(sequences), int(max_len)], dtype=dtype)
+    padded[rows, columns] = sequences.values
+    return padded
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent single-example requests into batches
+
+    One worker thread owns the predict function(and thus the session). It
+    blocks for the first pending request, then keeps collecting requests
+    until max_batch_size are pending or max_wait_ms have passed since the
+    first one, and runs them as a single batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5,
+                 latency_window=10000):
+        """
+        :param predict_fn: function mapping a list of examples to a list of
+            results of the same length, e.g. Predictor.predict
+        :param max_batch_size: maximum number of requests in one batch
+        :param max_wait_ms: maximum time to wait for more requests after the
+            first request of a batch arrives
+        :param latency_window: number of most recent requests the latency
+            percentiles are computed over
+        """
+        self._predict_fn = predict_fn
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+        self._num_requests = 0
+        self._num_batches = 0
+        self._num_errors = 0
+        self._predict_time = 0.0
+        self._latencies = deque(maxlen=latency_window)
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def predict(self, example):
+        """Blocks until the batch containing example has been predicted"""
+        request = _Request(example)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _predict_batch(self, batch):
+        results = self._predict_fn([request.example for request in batch])
+        assert len(results) == len(batch)
+        for request, result in zip(batch, results):
+            request.result = result
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            start_time = time.time()
+            try:
+                self._predict_batch(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].error = e
+                else:
+                    # retry the requests one at a time so that only the bad
+                    # ones fail
+                    for request in batch:
+                        try:
+                            self._predict_batch([request])
+                        except Exception as request_error:
+                            request.error = request_error
+            end_time = time.time()
+
+            with self._lock:
+                self._num_requests += len(batch)
+                self._num_batches += 1
+                self._predict_time += end_time - start_time
+                for request in batch:
+                    if request.error is not None:
+                        self._num_errors += 1
+                    self._latencies.append(end_time - request.start_time)
+            for request in batch:
+                request.done.set()
+
+    def stats(self):
+        """Latency and throughput counters since the batcher started"""
+        with self._lock:
+            elapsed = time.time() - self._start_time
+            latencies = np.asarray(self._latencies) * 1000
+            stats = {
+                'requests': self._num_requests,
+                'batches': self._num_batches,
+                'errors': self._num_errors,
+                'pending': self._queue.qsize(),
+                'mean_batch_size':
+                    self._num_requests / max(self._num_batches, 1),
+                'requests_per_sec': self._num_requests / elapsed,
+                'predict_time_sec': self._predict_time,
+                'uptime_sec': elapsed
+            }
+        if len(latencies):
+            stats['latency_ms'] = {
+                'mean': float(np.mean(latencies)),
+                'p50': float(np.percentile(latencies, 50)),
+                'p90': float(np.percentile(latencies, 90)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(np.max(latencies))
+            }
+        return stats
+
+
+class _Request(object):
+    def __init__(self, example):
+        self.example = example
+        self.start_time = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
@@ -16,6 +16,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import itertools
 import re
 
 import numpy as np
@@ -178,9 +180,12 @@ class VocabularyProcessor(object):
           self
         """
         print("Fitting the vocabulary...")
+        # count with a Counter, then add each word once
+        counts = collections.Counter()
         for tokens in tqdm(self._tokenizer(raw_documents)):
-            for token in tokens:
-                self.vocabulary_.add(token)
+            counts.update(tokens)
+        for token, count in six.iteritems(counts):
+            self.vocabulary_.add(token, count=count)
         # if self.min_frequency > 0:
         self.vocabulary_.trim(min_frequency=self.min_frequency,
                               max_frequency=self.max_frequency,
@@ -247,6 +252,63 @@ class VocabularyProcessor(object):
                 word_ids[idx] = self.vocabulary_.get(token)
             yield word_ids
 
+    def transform_flat(self, raw_documents, padding=False):
+        """Transform all the documents to word ids at once.
+
+        Same ids as transform()(or transform_pad() if padding), but all the
+        tokens are looked up in one pass with the dictionary of the frozen
+        vocabulary instead of one CategoricalVocabulary.get() call each, and
+        the ids are returned flat instead of one array per document.
+
+        Args:
+          raw_documents: An iterable which yield either str or unicode.
+          padding: whether to pad every document to max_document_length.
+
+        Returns:
+          ids: int32 array of the word ids of all the documents, document i
+            is ids[offsets[i]:offsets[i + 1]].
+          offsets: int64 array, [n_samples + 1].
+
+        Raises:
+          ValueError: if padding without a finite max_document_length.
+        """
+        documents = list(self._tokenizer(raw_documents))
+        max_len = self.max_document_length
+        if max_len is None or max_len == float('inf'):
+            # no maximum length(Dataset's default is inf)
+            if padding:
+                raise ValueError('Can\'t pad the documents without a finite '
+                                 'max_document_length!')
+            max_len = None
+            lengths = np.fromiter((len(tokens) for tokens in documents),
+                                  dtype=np.int64, count=len(documents))
+        else:
+            max_len = int(max_len)
+            lengths = np.fromiter((min(len(tokens), max_len)
+                                   for tokens in documents),
+                                  dtype=np.int64, count=len(documents))
+        offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # truncated by slicing, no per-token check of the position
+        tokens = itertools.chain.from_iterable(
+            tokens[:max_len] for tokens in documents)
+        if self.vocabulary_.frozen:
+            # unknown words are 0, as CategoricalVocabulary.get() when frozen
+            word_ids = map(self.vocabulary_.mapping.get, tokens,
+                           itertools.repeat(0))
+        else:
+            # new words are added to the vocabulary
+            word_ids = map(self.vocabulary_.get, tokens)
+        ids = np.fromiter(word_ids, dtype=np.int32, count=offsets[-1])
+
+        if padding:
+            padded = np.zeros([len(documents), max_len], dtype=np.int32)
+            padded[np.arange(max_len) < lengths[:, np.newaxis]] = ids
+            ids = padded.reshape(-1)
+            offsets = np.arange(len(documents) + 1, dtype=np.int64) * max_len
+        return ids, offsets
+
     def reverse(self, documents):
         """Reverses output of vocabulary mapping to words.
 
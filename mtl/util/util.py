@@ -180,6 +180,41 @@ def tfidf(tokenized_documents, vocab=None):
     return tfidf_documents
 
 
+def inverse_document_frequencies(doc_types, num_docs, vocab_size):
+    """Vectorized version of _inverse_document_frequencies() over word ids
+
+    :param doc_types: flat array of the word types of all the documents,
+        each type listed once per document it appears in
+    :param num_docs: number of documents
+    :param vocab_size: size of vocabulary
+    :return: np.ndarray of shape [vocab_size], 1 + log(num_docs / df)
+    """
+    doc_freqs = np.bincount(doc_types, minlength=vocab_size)
+    # words not in any document are treated as appearing in one
+    doc_freqs = np.maximum(doc_freqs, 1)
+    return (1 + np.log(num_docs / doc_freqs)).astype(np.float32)
+
+
+def sparse_tfidf(types, counts, offsets, idf):
+    """Vectorized tf-idf of documents stored as a CSR count matrix
+
+    Uses the sublinear term frequency 1 + log(count) as tfidf() does and
+    normalizes each document by its l2 norm.
+
+    :param types: flat array of the word types of all the documents
+    :param counts: count of each type in its document
+    :param offsets: the types of document i are types[offsets[i]:offsets[i+1]]
+    :param idf: np.ndarray returned by inverse_document_frequencies()
+    :return: np.ndarray of the tf-idf value of each type, aligned with types
+    """
+    values = (1 + np.log(counts)) * idf[types]
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    norms = np.sqrt(np.bincount(rows, weights=values ** 2,
+                                minlength=len(offsets) - 1))
+    values = values / (norms[rows] + np.finfo(np.float32).eps)
+    return values.astype(np.float32)
+
+
 def _cosine_similarity(vector1, vector2):
     dot_product = sum(p * q for p, q in zip(vector1, vector2))
     magnitude = (np.sqrt(sum([val ** 2 for val in vector1])) *
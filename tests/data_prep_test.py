@@ -0,0 +1,117 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""The fast preprocessing gives the same output as the original functions"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+
+import tensorflow as tf
+
+from mtl.util.constants import OLD_LINEBREAKS, LINEBREAK
+from mtl.util.data_prep import (clean_str,
+                                fast_clean_str,
+                                fast_preproc,
+                                fast_remove_urls,
+                                get_stem_fn,
+                                porter_stemmer,
+                                preproc,
+                                remove_stopwords,
+                                remove_urls,
+                                stem_and_remove_stopwords,
+                                stem_cache_info)
+
+DOCS = [
+    u'',
+    u'   ',
+    u"I can't believe it's not butter!! (really?)",
+    u"They'd've been there, wouldn't they? We'll see; you're right.",
+    u'see http://www.test.com and https://test.com/a?b=1 or'
+    u'http://glued.com',
+    u'this is aaaaaaaaa a aaaaaa badly beautiful day . , / ? ! \' :) " \' '
+    u'<img<!-- --> src=x onerror=alert(1);//><!-- --><ref/> test ref <ref>'
+    u'http://www.test.com<td><a href="http://www.fakewebsite.com">Please can '
+    u'you strip me?</a><br/><a href="http://www.fakewebsite.com">I am '
+    u'waiting....</a></td>',
+    u'first line<br /><br />second line\nthird\r\nfourth \\n fifth \\r',
+    u'Fish &amp; chips &lt;3 &copy 2018 &#39;quoted&#39;',
+    u'caf\xe9 na\xefve \u201csmart quotes\u201d \u2014 dash\ttab',
+    u'a\x00b  `back` \\(escaped\\) "double"',
+]
+
+
+def reference_preproc(text):
+    """The preprocessing of Dataset before fast_preproc()"""
+    text = text.strip()
+    text = preproc(text)
+    for old_linebreak in OLD_LINEBREAKS:
+        text = text.replace(old_linebreak, LINEBREAK)
+    return text
+
+
+def random_docs(num_docs, seed=42):
+    rng = random.Random(seed)
+    pieces = list(u"abnstvedlr'`\\\"(),!?.:/<>&;- \t\n\r\xe9") + [
+        u'http://x.com', u'https:', u"n't", u"'s", u"'ve", u"'ll", u"'re",
+        u"'d", u'<br /><br />', u'<b>', u'</b>', u'&amp;', u'\\n']
+    return [u''.join(rng.choice(pieces)
+                     for _ in range(rng.randint(0, 40)))
+            for _ in range(num_docs)]
+
+
+class DataPrepTest(tf.test.TestCase):
+    def test_clean_str(self):
+        for doc in DOCS + random_docs(2000):
+            self.assertEqual(fast_clean_str(doc), clean_str(doc))
+
+    def test_remove_urls(self):
+        for doc in DOCS + random_docs(2000):
+            self.assertEqual(fast_remove_urls(doc), remove_urls(doc))
+
+    def test_preproc(self):
+        for doc in DOCS + random_docs(500):
+            self.assertEqual(fast_preproc(doc), reference_preproc(doc))
+
+    def test_stem_and_remove_stopwords(self):
+        tokens = u'the cats were running and jumping over the fences'.split()
+        weights = [float(i) for i in range(len(tokens))]
+        stem_fn = get_stem_fn('porter_stemmer')
+
+        expected_tokens, expected_weights = remove_stopwords(
+            porter_stemmer(tokens), stopwords='nltk', weights=weights)
+        self.assertEqual(
+            stem_and_remove_stopwords(tokens, stem_fn=stem_fn,
+                                      stopwords='nltk', weights=weights),
+            (expected_tokens, expected_weights))
+        self.assertEqual(
+            stem_and_remove_stopwords(tokens, stem_fn=stem_fn,
+                                      stopwords='nltk'),
+            (remove_stopwords(porter_stemmer(tokens), stopwords='nltk'),
+             None))
+        self.assertEqual(stem_and_remove_stopwords(tokens),
+                         (tokens, None))
+
+        # every token has been stemmed before
+        hits = stem_cache_info()['porter_stemmer']['hits']
+        porter_stemmer(tokens)
+        self.assertEqual(stem_cache_info()['porter_stemmer']['hits'],
+                         hits + len(tokens))
+
+
+if __name__ == '__main__':
+    tf.test.main()
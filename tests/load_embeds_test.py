@@ -0,0 +1,83 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Test loading pretrained embeddings from text and converted files"""
+
+import io
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.util.load_embeds import (convert_pretrained,
+                                  get_pretrained_matrix,
+                                  get_pretrained_rows,
+                                  get_pretrained_shape,
+                                  load_pretrained_matrix,
+                                  load_pretrained_rows,
+                                  load_pretrianed_vocab_dict)
+
+
+class ConvertEmbeddingsTest(tf.test.TestCase):
+    def test_convert_glove(self):
+        pretrained_path = os.path.join(self.get_temp_dir(), 'glove.test.txt')
+        with io.open(pretrained_path, 'w', encoding='utf-8') as file:
+            file.write(u'the 0.1 0.2 -0.3\n'
+                       u'café 1.5 2.5 3.5\n'
+                       u'<UNK> 0 0 1e-3\n')
+
+        store_path = convert_pretrained(pretrained_path)
+        self.assertEqual(store_path,
+                         os.path.join(self.get_temp_dir(), 'glove.test.npy'))
+
+        matrix = load_pretrained_matrix(store_path)
+        self.assertIsInstance(matrix, np.memmap)
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertAllClose(matrix, load_pretrained_matrix(pretrained_path))
+        self.assertEqual(load_pretrianed_vocab_dict(store_path),
+                         load_pretrianed_vocab_dict(pretrained_path))
+
+        # only the rows of the given words, in their order
+        words = [u'<UNK>', u'the']
+        for path in [pretrained_path, store_path]:
+            self.assertAllClose(load_pretrained_rows(path, words),
+                                [[0, 0, 1e-3], [0.1, 0.2, -0.3]])
+        with self.assertRaises(ValueError):
+            load_pretrained_rows(pretrained_path, [u'the', u'missing'])
+
+    def test_cache(self):
+        pretrained_path = os.path.join(self.get_temp_dir(), 'glove.cache.txt')
+        with io.open(pretrained_path, 'w', encoding='utf-8') as file:
+            file.write(u'a 1 2\nb 3 4\n')
+
+        matrix = get_pretrained_matrix(pretrained_path)
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertIs(get_pretrained_matrix(pretrained_path), matrix)
+        self.assertEqual(get_pretrained_shape(pretrained_path), (2, 2))
+        self.assertAllClose(get_pretrained_rows(pretrained_path, [u'b']),
+                            [[3, 4]])
+
+        # a modified file is read again
+        with io.open(pretrained_path, 'w', encoding='utf-8') as file:
+            file.write(u'a 5 6\nb 7 8\nc 9 0\n')
+        mtime = os.path.getmtime(pretrained_path) + 10
+        os.utime(pretrained_path, (mtime, mtime))
+        self.assertAllClose(get_pretrained_matrix(pretrained_path),
+                            [[5, 6], [7, 8], [9, 0]])
+        self.assertEqual(get_pretrained_shape(pretrained_path), (3, 2))
+
+
+if __name__ == '__main__':
+    tf.test.main()
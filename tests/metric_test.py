@@ -15,15 +15,19 @@
 
 """Test cases from sklearn.metrics examples"""
 
+import numpy as np
 import tensorflow as tf
 
 from mtl.util.metrics import (accuracy_score,
                               accurate_number,
+                              confusion_matrix,
                               recall_macro,
                               f1_macro,
+                              f1_pos_neg_macro,
                               mae_macro,
                               neg_mae_macro,
-                              precision_macro)
+                              precision_macro,
+                              StreamingMetrics)
 
 
 class MetricTest(tf.test.TestCase):
@@ -119,5 +123,52 @@ class MetricTest(tf.test.TestCase):
         )
 
 
+class StreamingMetricsTest(tf.test.TestCase):
+    def test_same_as_metrics(self):
+        rng = np.random.RandomState(42)
+        y_trues = rng.randint(0, 4, size=100)
+        y_preds = rng.randint(0, 5, size=100)  # 4 is not in labels
+        topics = rng.choice(['a', 'b', 'c'], size=100)
+        labels = [0, 1, 2, 3]
+
+        streaming_metrics = StreamingMetrics(labels)
+        for start in range(0, 100, 32):
+            streaming_metrics.update(y_trues[start:start + 32],
+                                     y_preds[start:start + 32],
+                                     topics[start:start + 32])
+
+        y_trues = y_trues.tolist()
+        y_preds = y_preds.tolist()
+        topics = topics.tolist()
+        self.assertEqual(streaming_metrics.ntotal, 100)
+        self.assertEqual(streaming_metrics.accurate_number(),
+                         accurate_number(y_trues, y_preds, labels, topics))
+        for metric, func in [('Acc', accuracy_score),
+                             ('F1_Macro', f1_macro),
+                             ('F1_PosNeg_Macro', f1_pos_neg_macro),
+                             ('Recall_Macro', recall_macro),
+                             ('Precision_Macro', precision_macro),
+                             ('MAE_Macro', mae_macro),
+                             ('Neg_MAE_Macro', neg_mae_macro)]:
+            self.assertAlmostEqual(streaming_metrics.score(metric),
+                                   func(y_trues, y_preds, labels, topics),
+                                   msg=metric)
+        self.assertAllEqual(streaming_metrics.score('Confusion_Matrix'),
+                            confusion_matrix(y_trues, y_preds, labels,
+                                             topics))
+
+        # macro-average over topics only
+        streaming_metrics = StreamingMetrics([])
+        streaming_metrics.update(y_trues, y_preds, topics)
+        self.assertAlmostEqual(streaming_metrics.mae_macro(),
+                               mae_macro(y_trues, y_preds, [], topics))
+
+    def test_without_topics(self):
+        streaming_metrics = StreamingMetrics([0, 1])
+        streaming_metrics.update([0, 1, 1], [0, 0, 1])
+        self.assertEqual(streaming_metrics.mae_macro(), float('inf'))
+        self.assertAlmostEqual(streaming_metrics.accuracy_score(), 2 / 3)
+
+
 if __name__ == '__main__':
     tf.test.main()
@@ -0,0 +1,66 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Test the sparse updates and the slot memory of the optimizers"""
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.util.optimizer import Optimizer
+
+
+class OptimizerTest(tf.test.TestCase):
+    def sparse_step(self, optimizer, **kwargs):
+        config = Optimizer.H()
+        config.optimizer = optimizer
+        config.lr = 0.1
+        for k, v in kwargs.items():
+            setattr(config, k, v)
+        with tf.Graph().as_default():
+            init = np.arange(15, dtype=np.float32).reshape(5, 3) / 15.0
+            embedding = tf.get_variable('embedding', initializer=init)
+            loss = tf.reduce_sum(
+                tf.square(tf.gather(embedding, tf.constant([1, 3, 3]))))
+            optim = Optimizer(config=config)
+            train_op = optim.minimize(loss)
+            with self.test_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                sess.run(train_op)
+                value = sess.run(embedding)
+            return init, value, optim.state_bytes()
+
+    def test_lazy_updates(self):
+        for optimizer in ['lazy_adam', 'adafactor']:
+            init, value, _ = self.sparse_step(optimizer)
+            # only the rows in the batch are updated
+            self.assertAllEqual(value[[0, 2, 4]], init[[0, 2, 4]])
+            self.assertTrue(np.all(value[[1, 3]] < init[[1, 3]]))
+
+    def test_state_bytes(self):
+        _, _, state = self.sparse_step('adam')
+        # two float32 moments
+        self.assertEqual(state, [('embedding', 60, 120)])
+
+        _, _, state = self.sparse_step('adafactor',
+                                       adafactor_slot_dtype='float16')
+        # factored float16 row and column moments
+        self.assertEqual(state, [('embedding', 60, (5 + 3) * 2)])
+
+        with self.assertRaises(ValueError):
+            self.sparse_step('adam', adafactor_slot_dtype='float16')
+
+
+if __name__ == '__main__':
+    tf.test.main()
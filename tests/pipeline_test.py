@@ -47,9 +47,9 @@ class PipelineTests(tf.test.TestCase):
         self._N = 16
         self._batch_size = 4
 
-    def write_examples(self):
+    def write_examples(self, file_name='records.tf'):
         tmp_dir = self.get_temp_dir()
-        file_name = os.path.join(tmp_dir, 'records.tf')
+        file_name = os.path.join(tmp_dir, file_name)
         with tf.python_io.TFRecordWriter(file_name) as w:
             for s in random_sequences(self._N, 5, 5):
                 example = tf.train.Example(features=tf.train.Features(
@@ -96,6 +96,50 @@ class PipelineTests(tf.test.TestCase):
             with self.assertRaises(tf.errors.OutOfRangeError):
                 batch_v = sess.run(dataset.batch)
 
+    def test_shards(self):
+        tf_paths = [self.write_examples('records-%05d-of-00002.tf' % i)
+                    for i in range(2)]
+        feature_map = {
+            'sequence': tf.VarLenFeature(tf.int64),
+            'length': tf.FixedLenFeature([1], tf.int64)
+        }
+        dataset = Pipeline(tf_paths, feature_map,
+                           batch_size=self._batch_size,
+                           num_epochs=1, one_shot=True)
+        num_examples = 0
+        with self.test_session() as sess:
+            with self.assertRaises(tf.errors.OutOfRangeError):
+                while True:
+                    batch_v = sess.run(dataset.batch)
+                    num_examples += batch_v['length'].shape[0]
+        self.assertEqual(num_examples, 2 * self._N)
+
+    def test_buckets(self):
+        tf_path = self.write_examples()
+        feature_map = {
+            'sequence': tf.VarLenFeature(tf.int64),
+            'length': tf.FixedLenFeature([1], tf.int64)
+        }
+        boundaries = [3]
+        dataset = Pipeline(tf_path, feature_map,
+                           batch_size=2,
+                           num_epochs=1, one_shot=True,
+                           bucket_boundaries=boundaries,
+                           bucket_length_keys=['length'])
+        num_examples = 0
+        with self.test_session() as sess:
+            with self.assertRaises(tf.errors.OutOfRangeError):
+                while True:
+                    batch_v = sess.run(dataset.batch)
+                    lengths = batch_v['length'][:, 0]
+                    num_examples += len(lengths)
+                    # all the examples of a batch are in the same bucket
+                    self.assertEqual(len(set(lengths < boundaries[0])), 1)
+                    # and padded to the longest of them
+                    self.assertEqual(batch_v['sequence'].shape[1],
+                                     max(lengths))
+        self.assertEqual(num_examples, self._N)
+
 
 if __name__ == "__main__":
     tf.test.main()
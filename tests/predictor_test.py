@@ -0,0 +1,94 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Test that MicroBatcher coalesces concurrent requests"""
+
+import threading
+
+import tensorflow as tf
+
+from mtl.util.predictor import MicroBatcher
+
+
+class MicroBatcherTest(tf.test.TestCase):
+    def test_batches(self):
+        batch_sizes = []
+
+        def predict_fn(examples):
+            batch_sizes.append(len(examples))
+            return [example * 2 for example in examples]
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=4, max_wait_ms=200)
+        results = dict()
+
+        def request(i):
+            results[i] = batcher.predict(i)
+
+        threads = [threading.Thread(target=request, args=(i,))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {i: i * 2 for i in range(10)})
+        self.assertEqual(sum(batch_sizes), 10)
+        self.assertLessEqual(max(batch_sizes), 4)
+        self.assertLess(len(batch_sizes), 10)
+
+        stats = batcher.stats()
+        self.assertEqual(stats['requests'], 10)
+        self.assertEqual(stats['batches'], len(batch_sizes))
+        self.assertEqual(stats['errors'], 0)
+        self.assertIn('p99', stats['latency_ms'])
+
+    def test_error(self):
+        def predict_fn(examples):
+            raise ValueError('bad batch')
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=4, max_wait_ms=1)
+        with self.assertRaises(ValueError):
+            batcher.predict('text')
+        self.assertEqual(batcher.stats()['errors'], 1)
+
+    def test_bad_example(self):
+        def predict_fn(examples):
+            return [1 // example for example in examples]
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=8, max_wait_ms=200)
+        results = dict()
+        errors = dict()
+
+        def request(i):
+            try:
+                results[i] = batcher.predict(i)
+            except ZeroDivisionError as e:
+                errors[i] = e
+
+        threads = [threading.Thread(target=request, args=(i,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # only the request of 0 fails
+        self.assertEqual(list(errors), [0])
+        self.assertEqual(results, {i: 1 // i for i in range(1, 4)})
+        self.assertEqual(batcher.stats()['errors'], 1)
+
+
+if __name__ == '__main__':
+    tf.test.main()
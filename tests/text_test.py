@@ -0,0 +1,69 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.util.text import VocabularyProcessor, tokenizer_simple
+
+DOCS = [['a', 'b', 'c', 'a'],
+        [],
+        ['d', 'e', 'a', 'b', 'b', 'x', 'y'],
+        ['c']]
+
+
+class VocabularyProcessorTest(tf.test.TestCase):
+    def get_vocab_processor(self):
+        vocab_processor = VocabularyProcessor(max_document_length=5,
+                                              tokenizer_fn=tokenizer_simple)
+        vocab_processor.fit([['a', 'b', 'c', 'a'], ['b', 'd']])
+        return vocab_processor
+
+    def test_transform_flat(self):
+        vocab_processor = self.get_vocab_processor()
+        ids, offsets = vocab_processor.transform_flat(DOCS)
+        expected = list(vocab_processor.transform(DOCS))
+        self.assertAllEqual(offsets,
+                            np.cumsum([0] + [len(e) for e in expected]))
+        for i, word_ids in enumerate(expected):
+            self.assertAllEqual(ids[offsets[i]:offsets[i + 1]], word_ids)
+
+    def test_transform_flat_padding(self):
+        vocab_processor = self.get_vocab_processor()
+        ids, offsets = vocab_processor.transform_flat(DOCS, padding=True)
+        self.assertAllEqual(offsets, [0, 5, 10, 15, 20])
+        self.assertAllEqual(ids.reshape([len(DOCS), 5]),
+                            list(vocab_processor.transform_pad(DOCS)))
+
+    def test_transform_flat_no_max_length(self):
+        # Dataset's default max_document_length
+        vocab_processor = VocabularyProcessor(
+            max_document_length=float('inf'), tokenizer_fn=tokenizer_simple)
+        vocab_processor.fit([['a', 'b', 'c', 'a'], ['b', 'd']])
+        ids, offsets = vocab_processor.transform_flat(DOCS)
+        self.assertAllEqual(offsets, np.cumsum([0] + [len(d) for d in DOCS]))
+        mapping = vocab_processor.vocabulary_.mapping
+        self.assertAllEqual(ids, [mapping.get(token, 0)
+                                  for doc in DOCS for token in doc])
+        with self.assertRaises(ValueError):
+            vocab_processor.transform_flat(DOCS, padding=True)
+
+
+if __name__ == '__main__':
+    tf.test.main()
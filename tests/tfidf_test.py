@@ -0,0 +1,57 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Test the vectorized tf-idf against the pure Python version"""
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.util.util import (inverse_document_frequencies,
+                           sparse_tfidf,
+                           tfidf)
+
+
+class TfidfTest(tf.test.TestCase):
+    def test_sparse_tfidf(self):
+        docs = [[1, 2, 2, 3, 3, 3, 0],
+                [4, 5, 6, 7, 0],
+                [1, 2, 3, 4, 5, 6, 7, 8, 0]]
+        vocab_size = 10
+        vocab = list(range(vocab_size))
+
+        # CSR count matrix of the documents
+        types, counts, offsets = [], [], [0]
+        for doc in docs:
+            doc_types, doc_counts = np.unique(doc, return_counts=True)
+            types.extend(doc_types)
+            counts.extend(doc_counts)
+            offsets.append(len(types))
+        types = np.asarray(types)
+        counts = np.asarray(counts)
+
+        idf = inverse_document_frequencies(types, len(docs), vocab_size)
+        values = sparse_tfidf(types, counts, np.asarray(offsets), idf)
+
+        expected = np.asarray(tfidf(docs, vocab))
+        expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+        for i in range(len(docs)):
+            row = np.zeros(vocab_size)
+            row[types[offsets[i]:offsets[i + 1]]] = \
+                values[offsets[i]:offsets[i + 1]]
+            self.assertAllClose(row, expected[i], atol=1e-6)
+
+
+if __name__ == "__main__":
+    tf.test.main()